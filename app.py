@@ -1,18 +1,163 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, g, has_request_context
+from flask import before_render_template, template_rendered, session as flask_session
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timezone
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import datetime, timezone, timedelta
 import os
 import time
-from sqlalchemy import desc, text
+import json
+import base64
+import hashlib
+import queue
+import threading
+import bisect
+import random
+import heapq
+import math
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from sqlalchemy import text, table as sa_table, column as sa_column, create_engine, event as sa_event
+from sqlalchemy.engine import Engine
+from markupsafe import Markup
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import re
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-123'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///freelance.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///freelance.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# метод и стоимость хеша паролей в формате werkzeug; старые хеши пересчитываются при входе
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+# число доверенных обратных прокси перед приложением; без них remote_addr - адрес прокси,
+# и лимит неудачных входов по IP делят все клиенты
+app.config['PROXY_FIX_HOPS'] = int(os.environ.get('PROXY_FIX_HOPS', 0))
+if app.config['PROXY_FIX_HOPS']:
+    hops = app.config['PROXY_FIX_HOPS']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
+# профили подключения к SQLite
+# default - настройки SQLite по умолчанию, одно подключение на запрос;
+# wal - журнал WAL, читатели не ждут писателя: SELECT идут в пул чтения,
+#       пишущие транзакции процесса выполняются по одной и не конфликтуют за блокировку файла
+SQLITE_PROFILES = {
+    'default': {
+        'pragmas': {},
+        'read_pool_size': 0,
+        'serialize_writes': False,
+    },
+    'wal': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,  # в КиБ
+            'temp_store': 'MEMORY',
+        },
+        'read_pool_size': 8,
+        'serialize_writes': True,
+    },
+}
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'wal')
+WRITE_LOCK_TIMEOUT = 30
+
+read_engines = {}
+read_engines_lock = threading.Lock()
+write_lock = threading.RLock()
+
+
+def sqlite_profile():
+    return SQLITE_PROFILES[app.config['SQLITE_PROFILE']]
+
+
+@sa_event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """PRAGMA профиля на каждое новое подключение к SQLite"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in sqlite_profile()['pragmas'].items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
+def set_query_only(dbapi_connection, connection_record):
+    dbapi_connection.execute('PRAGMA query_only=1')
+
+
+def acquire_write_lock(connection):
+    """одна пишущая транзакция на процесс; повторный вход из того же потока разрешен"""
+    if not write_lock.acquire(timeout=WRITE_LOCK_TIMEOUT):
+        raise sa_exc.TimeoutError(f'Нет доступа на запись к базе дольше {WRITE_LOCK_TIMEOUT} с')
+    connection.info['write_lock'] = True
+
+
+def release_write_lock(connection):
+    if connection.info.pop('write_lock', False):
+        write_lock.release()
+
+
+def get_read_engine(write_engine):
+    """пул подключений только для чтения к той же базе; None - читать через основной движок"""
+    pool_size = sqlite_profile()['read_pool_size']
+    url = write_engine.url
+    if not pool_size or url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    with read_engines_lock:
+        if url not in read_engines:
+            read_engine = create_engine(url, pool_size=pool_size, max_overflow=pool_size,
+                                        connect_args={'timeout': 5})
+            sa_event.listen(read_engine, 'connect', set_query_only)
+            read_engines[url] = read_engine
+        return read_engines[url]
+
+
+class RoutingSession(FlaskSession):
+    """SELECT вне пишущей транзакции - в пул чтения, остальное - в основной движок
+
+    после первой записи (flush, UPDATE/INSERT/DELETE, произвольный SQL) транзакция до commit
+    читает через основной движок, чтобы видеть собственные изменения
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        write_bind = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or write_bind is not self._db.engine:
+            return write_bind
+        if self._flushing:
+            # flush открывает пишущую транзакцию - следующие SELECT должны видеть ее строки
+            self.info['writing'] = True
+            return write_bind
+        if self.info.get('writing'):
+            return write_bind
+        if clause is None or not getattr(clause, 'is_select', False):
+            self.info['writing'] = True
+            return write_bind
+        return get_read_engine(write_bind) or write_bind
+
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+with app.app_context():
+    if db.engine.url.get_backend_name() == 'sqlite' and sqlite_profile()['serialize_writes']:
+        sa_event.listen(db.engine, 'begin', acquire_write_lock)
+        sa_event.listen(db.engine, 'commit', release_write_lock)
+        sa_event.listen(db.engine, 'rollback', release_write_lock)
+
+
+@sa_event.listens_for(RoutingSession, 'after_commit')
+@sa_event.listens_for(RoutingSession, 'after_rollback')
+def end_write_transaction(session):
+    session.info.pop('writing', None)
+
 
-db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Пожалуйста, войдите в систему'
@@ -26,8 +171,16 @@ class User(UserMixin, db.Model):
     is_client = db.Column(db.Boolean, default=False)
     is_moderator = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
+    # растет с каждым изменением, после которого кеши пользователей во всех процессах устаревают
+    session_version = db.Column(db.Integer, default=1, nullable=False, server_default='1')
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # агрегаты рейтинга: отзывы о пользователе как об исполнителе и отзывы по его проектам как заказчика
+    rating_count = db.Column(db.Integer, default=0, nullable=False)
+    rating_sum = db.Column(db.Integer, default=0, nullable=False)
+    client_rating_count = db.Column(db.Integer, default=0, nullable=False)
+    client_rating_sum = db.Column(db.Integer, default=0, nullable=False)
+
     profile = db.relationship('Profile', backref='user', uselist=False)
     notifications = db.relationship('Notification', backref='user', lazy='dynamic')
     sent_messages = db.relationship('Message', foreign_keys='Message.sender_id', backref='sender', lazy='dynamic')
@@ -35,6 +188,18 @@ class User(UserMixin, db.Model):
     support_tickets = db.relationship('SupportTicket', backref='user', lazy='dynamic')
     ticket_messages = db.relationship('TicketMessage', backref='user', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_user_created', 'created_at'),
+    )
+
+    @property
+    def freelancer_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0
+
+    @property
+    def client_rating(self):
+        return self.client_rating_sum / self.client_rating_count if self.client_rating_count else 0
+
 
 class Profile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -46,6 +211,10 @@ class Profile(db.Model):
     hourly_rate = db.Column(db.Float)
     experience = db.Column(db.String(50))
 
+    __table_args__ = (
+        db.Index('ix_profile_user', 'user_id'),
+    )
+
 
 class Project(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -61,6 +230,8 @@ class Project(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     completed_at = db.Column(db.DateTime, nullable=True)
     status = db.Column(db.String(20), default='open')
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # растет при каждом изменении
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))  # время последнего изменения
 
     client = db.relationship('User', foreign_keys=[client_id], backref='created_projects')
     freelancer = db.relationship('User', foreign_keys=[freelancer_id], backref='assigned_projects')
@@ -68,6 +239,178 @@ class Project(db.Model):
     # связь с фрилансером
     freelancer = db.relationship('User', foreign_keys=[freelancer_id], backref='assigned_projects')
 
+    __table_args__ = (
+        db.Index('ix_project_status_created', 'status', 'created_at'),
+        db.Index('ix_project_created', 'created_at'),
+        db.Index('ix_project_updated', 'updated_at'),
+        db.Index('ix_project_client_status', 'client_id', 'status'),
+        db.Index('ix_project_freelancer_status', 'freelancer_id', 'status'),
+    )
+
+
+# нормализованные навыки: строки skills_required/technologies/skills остаются для отображения,
+# а фильтрация идет по таблицам связей
+class Skill(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)  # в нижнем регистре, см. parse_skills
+
+
+project_skill = db.Table(
+    'project_skill',
+    db.Column('skill_id', db.Integer, db.ForeignKey('skill.id'), primary_key=True),
+    db.Column('project_id', db.Integer, db.ForeignKey('project.id'), primary_key=True),
+    db.Index('ix_project_skill_project', 'project_id'),
+)
+
+profile_skill = db.Table(
+    'profile_skill',
+    db.Column('skill_id', db.Integer, db.ForeignKey('skill.id'), primary_key=True),
+    db.Column('profile_id', db.Integer, db.ForeignKey('profile.id'), primary_key=True),
+    db.Index('ix_profile_skill_profile', 'profile_id'),
+)
+
+SKILL_LOOKUP_CHUNK = 500
+
+
+def ensure_skills(connection, names):
+    """id навыков по именам; недостающие создаются (одновременная вставка из другого процесса не мешает)"""
+    names = sorted(names)
+    skill_ids = {}
+    for start in range(0, len(names), SKILL_LOOKUP_CHUNK):
+        chunk = names[start:start + SKILL_LOOKUP_CHUNK]
+        connection.execute(sqlite_insert(Skill).values([{'name': name} for name in chunk])
+                           .on_conflict_do_nothing(index_elements=['name']))
+        skill_ids.update((name, skill_id) for skill_id, name in connection.execute(
+            db.select(Skill.id, Skill.name).where(Skill.name.in_(chunk))))
+    return skill_ids
+
+
+def set_skill_links(connection, owner_column, owner_id, names):
+    """заменяет навыки проекта или профиля"""
+    link_table = owner_column.table
+    connection.execute(db.delete(link_table).where(owner_column == owner_id))
+    if names:
+        skill_ids = ensure_skills(connection, names)
+        connection.execute(db.insert(link_table), [
+            {'skill_id': skill_ids[name], owner_column.name: owner_id} for name in names])
+
+
+def fields_changed(obj, *attributes):
+    state = db.inspect(obj)
+    return any(state.attrs[attribute].history.has_changes() for attribute in attributes)
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def sync_skill_links(session, flush_context):
+    """связи навыков обновляются в той же транзакции, что и строковые поля"""
+    connection = session.connection()
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Project) and fields_changed(obj, 'skills_required', 'technologies'):
+            set_skill_links(connection, project_skill.c.project_id, obj.id,
+                            parse_skills(obj.skills_required) | parse_skills(obj.technologies))
+        elif isinstance(obj, Profile) and fields_changed(obj, 'skills'):
+            set_skill_links(connection, profile_skill.c.profile_id, obj.id, parse_skills(obj.skills))
+    for obj in session.deleted:
+        if isinstance(obj, Project):
+            set_skill_links(connection, project_skill.c.project_id, obj.id, ())
+        elif isinstance(obj, Profile):
+            set_skill_links(connection, profile_skill.c.profile_id, obj.id, ())
+
+
+def fill_skill_tags(chunk_size=10000):
+    """заново строит связи навыков из строковых полей всех проектов и профилей"""
+    connection = db.session.connection()
+    sources = [
+        (project_skill.c.project_id, Project.id, lambda row: parse_skills(row[1]) | parse_skills(row[2]),
+         db.select(Project.id, Project.skills_required, Project.technologies)),
+        (profile_skill.c.profile_id, Profile.id, lambda row: parse_skills(row[1]),
+         db.select(Profile.id, Profile.skills)),
+    ]
+    for owner_column, id_column, row_skills, select in sources:
+        connection.execute(db.delete(owner_column.table))
+        last_id = 0
+        while True:
+            rows = connection.execute(select.where(id_column > last_id).order_by(id_column).limit(chunk_size)).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            owners = [(row[0], row_skills(row)) for row in rows]
+            skill_ids = ensure_skills(connection, set().union(*(names for _, names in owners)))
+            links = [{'skill_id': skill_ids[name], owner_column.name: owner_id}
+                     for owner_id, names in owners for name in names]
+            if links:
+                connection.execute(db.insert(owner_column.table), links)
+
+
+def filter_by_skills(query, names, match_all=True):
+    """проекты с указанными навыками: со всеми (AND) или хотя бы с одним (OR)"""
+    linked = db.select(project_skill.c.project_id).join(Skill, Skill.id == project_skill.c.skill_id).where(
+        Skill.name.in_(names))
+    if match_all:
+        linked = linked.group_by(project_skill.c.project_id).having(db.func.count() == len(names))
+    return query.filter(Project.id.in_(linked))
+
+
+# полнотекстовый поиск по проектам (FTS5, внешний контент - таблица project)
+PROJECT_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS project_fts USING fts5(
+        title, description, skills_required, technologies,
+        content='project', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS project_fts_ai AFTER INSERT ON project BEGIN
+        INSERT INTO project_fts (rowid, title, description, skills_required, technologies)
+        VALUES (new.id, new.title, new.description, new.skills_required, new.technologies);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS project_fts_ad AFTER DELETE ON project BEGIN
+        INSERT INTO project_fts (project_fts, rowid, title, description, skills_required, technologies)
+        VALUES ('delete', old.id, old.title, old.description, old.skills_required, old.technologies);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS project_fts_au
+    AFTER UPDATE OF title, description, skills_required, technologies ON project BEGIN
+        INSERT INTO project_fts (project_fts, rowid, title, description, skills_required, technologies)
+        VALUES ('delete', old.id, old.title, old.description, old.skills_required, old.technologies);
+        INSERT INTO project_fts (rowid, title, description, skills_required, technologies)
+        VALUES (new.id, new.title, new.description, new.skills_required, new.technologies);
+    END""",
+]
+
+for ddl in PROJECT_FTS_DDL:
+    db.event.listen(Project.__table__, 'after_create', db.DDL(ddl))
+db.event.listen(Project.__table__, 'before_drop', db.DDL('DROP TABLE IF EXISTS project_fts'))
+
+project_fts = sa_table('project_fts', sa_column('rowid'), sa_column('project_fts'))
+
+
+def fts_match_query(search):
+    """строка поиска -> запрос MATCH: каждое слово как префикс, слова через AND"""
+    words = re.findall(r'\w+', search.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_projects(query, search):
+    """фильтр по полнотекстовому индексу; возвращает запрос и колонку релевантности bm25 (меньше - лучше)"""
+    match_query = fts_match_query(search)
+    if not match_query:
+        return query, None
+
+    matches = db.select(
+        project_fts.c.rowid.label('project_id'),
+        db.func.bm25(project_fts.c.project_fts).label('rank')
+    ).where(project_fts.c.project_fts.op('MATCH')(match_query)).subquery()
+
+    return query.join(matches, matches.c.project_id == Project.id), matches.c.rank
+
+
+def paginate_projects(query, search=None):
+    """страница списка проектов: по релевантности при поиске, иначе от новых к старым"""
+    rank = None
+    if search:
+        query, rank = search_projects(query, search)
+    if rank is not None:
+        return keyset_paginate(query, rank, Project.id, descending=False)
+    return keyset_paginate(query, Project.created_at, Project.id)
+
+
 class ProjectResponse(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
@@ -80,6 +423,11 @@ class ProjectResponse(db.Model):
     project = db.relationship('Project', backref='responses')
     freelancer = db.relationship('User', foreign_keys=[freelancer_id], backref='project_responses')
 
+    __table_args__ = (
+        db.Index('ix_project_response_project_freelancer', 'project_id', 'freelancer_id'),
+        db.Index('ix_project_response_freelancer', 'freelancer_id'),
+    )
+
     def reject(self):
         """отклонить отклик"""
         self.status = 'rejected'
@@ -103,6 +451,16 @@ class Notification(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     related_id = db.Column(db.Integer)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    unread_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')  # для сводных уведомлений о сообщениях
+
+    __table_args__ = (
+        db.Index('ix_notification_user_read_created', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_notification_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notification_related', 'related_id', 'notification_type'),
+        # одно уведомление о сообщениях на пару (получатель, отправитель)
+        db.Index('ux_notification_message_sender', 'user_id', 'related_id', unique=True,
+                 sqlite_where=db.text("notification_type = 'message'")),
+    )
 
 
 class Message(db.Model):
@@ -110,9 +468,70 @@ class Message(db.Model):
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
+    # не обновляется: прочтение хранится отметкой в conversation, поле нужно только для старых баз
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        db.Index('ix_message_sender_receiver_created', 'sender_id', 'receiver_id', 'created_at'),
+        db.Index('ix_message_receiver_read', 'receiver_id', 'is_read'),
+        db.Index('ix_message_pair_id', 'sender_id', 'receiver_id', 'id'),
+    )
+
+
+class Conversation(db.Model):
+    """сводка диалога - одна строка на пару пользователей (user1_id < user2_id)
+
+    userN_last_read_id - id последнего прочитанного стороной сообщения: входящие сообщения
+    с большим id не прочитаны; userN_unread - их число, поддерживается вместе с отметкой
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user1_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user2_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id'))
+    last_message_at = db.Column(db.DateTime)
+    user1_unread = db.Column(db.Integer, default=0, nullable=False)
+    user2_unread = db.Column(db.Integer, default=0, nullable=False)
+    user1_last_read_id = db.Column(db.Integer, default=0, nullable=False)
+    user2_last_read_id = db.Column(db.Integer, default=0, nullable=False)
+
+    last_message = db.relationship('Message', foreign_keys=[last_message_id])
+
+    __table_args__ = (
+        db.UniqueConstraint('user1_id', 'user2_id', name='uq_conversation_pair'),
+        db.Index('ix_conversation_user1_last', 'user1_id', 'last_message_id'),
+        db.Index('ix_conversation_user2_last', 'user2_id', 'last_message_id'),
+    )
+
+    @staticmethod
+    def pair(user_a_id, user_b_id):
+        return (user_a_id, user_b_id) if user_a_id <= user_b_id else (user_b_id, user_a_id)
+
+    @classmethod
+    def between(cls, user_a_id, user_b_id):
+        user1_id, user2_id = cls.pair(user_a_id, user_b_id)
+        return cls.query.filter_by(user1_id=user1_id, user2_id=user2_id).first()
+
+    def unread_for(self, user_id):
+        return self.user1_unread if user_id == self.user1_id else self.user2_unread
+
+    def last_read_for(self, user_id):
+        return self.user1_last_read_id if user_id == self.user1_id else self.user2_last_read_id
+
+    def mark_read(self, user_id):
+        """сдвинуть отметку прочтения стороны user_id до последнего сообщения
+
+        возвращает, сколько входящих стало прочитанными; при 0 строка не меняется
+        """
+        unread = self.unread_for(user_id)
+        if not unread:
+            return 0
+        if user_id == self.user1_id:
+            self.user1_last_read_id, self.user1_unread = self.last_message_id, 0
+        else:
+            self.user2_last_read_id, self.user2_unread = self.last_message_id, 0
+        return unread
+
 
 class SupportTicket(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -128,6 +547,12 @@ class SupportTicket(db.Model):
 
     messages = db.relationship('TicketMessage', backref='ticket', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_support_ticket_user_created', 'user_id', 'created_at'),
+        db.Index('ix_support_ticket_status_created', 'status', 'created_at'),
+        db.Index('ix_support_ticket_created', 'created_at'),
+    )
+
 
 class TicketMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -137,6 +562,11 @@ class TicketMessage(db.Model):
     is_admin_response = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        db.Index('ix_ticket_message_ticket_created', 'ticket_id', 'created_at'),
+        db.Index('ix_ticket_message_user', 'user_id'),
+    )
+
 
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -151,41 +581,794 @@ class Review(db.Model):
     reviewer = db.relationship('User', foreign_keys=[reviewer_id], backref='given_reviews')
     freelancer = db.relationship('User', foreign_keys=[freelancer_id], backref='received_reviews')
 
+    __table_args__ = (
+        db.Index('ix_review_freelancer_created', 'freelancer_id', 'created_at'),
+        db.Index('ix_review_project', 'project_id'),
+        db.Index('ix_review_reviewer', 'reviewer_id'),
+    )
+
+
+class OutboxEvent(db.Model):
+    """побочное действие, записанное в одной транзакции с основным изменением
+
+    status: pending - ждет обработки, processing - взято воркером до available_at,
+    failed - исчерпаны попытки; обработанные события удаляются
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    available_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.Index('ix_outbox_event_status_available', 'status', 'available_at'),
+    )
+
+
+class UserCounter(db.Model):
+    """счетчик пользователя (непрочитанные уведомления); меняется дельтами в транзакциях изменений"""
+    user_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.Integer, default=0, nullable=False)
+
+
+class RealtimeEvent(db.Model):
+    """событие для потока /api/events, записанное в одной транзакции с изменением
+
+    поток каждого воркера читает события пользователя после последнего отданного id,
+    поэтому событие доходит до клиента независимо от того, какой процесс его создал
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    event = db.Column(db.String(20), nullable=False)
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_realtime_event_user', 'user_id', 'id'),
+        db.Index('ix_realtime_event_created', 'created_at'),
+    )
+
+
+class DeletionJob(db.Model):
+    """фоновое каскадное удаление пользователя или проекта, выполняется порциями через outbox"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # user, project
+    target_id = db.Column(db.Integer, nullable=False)
+    target_name = db.Column(db.String(200))
+    status = db.Column(db.String(20), default='running', nullable=False)  # running, done
+    step = db.Column(db.Integer, default=0, nullable=False)  # номер текущего шага каскада
+    deleted_rows = db.Column(db.Integer, default=0, nullable=False)
+    total_rows = db.Column(db.Integer, default=0, nullable=False)  # оценка при постановке в очередь
+    rated_users = db.Column(db.Text, default='[]', nullable=False)  # JSON: чьи рейтинги пересчитать в конце
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_deletion_job_target', 'kind', 'target_id', 'status'),
+        db.Index('ix_deletion_job_created', 'created_at'),
+    )
+
+
+# кеш пользователей сессий для login_manager
+USER_CACHE_SIZE = 10000
+
+
+class UserCache:
+    """LRU пользователей сессий вместе с профилем, общий для всех запросов процесса
+
+    хранятся отсоединенные от сессии объекты; в запрос они попадают через merge(load=False)
+    без SQL. Запись годна, пока user.session_version в базе совпадает с версией объекта -
+    так блокировку или новый профиль видят все процессы. Свой процесс сбрасывает запись
+    сразу после commit; загрузка, начатая до сброса, в кеш уже не попадает
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, user_id, version, loader):
+        with self.lock:
+            user = self.entries.get(user_id)
+            if user and user.session_version == version:
+                self.entries.move_to_end(user_id)
+                return user
+            generation = self.generation
+        user = loader(user_id)
+        with self.lock:
+            if user and generation == self.generation:
+                self.entries[user_id] = user
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return user
+
+    def holds(self, user):
+        """объект - все еще действующая запись кеша"""
+        with self.lock:
+            return self.entries.get(user.id) is user
+
+    def invalidate(self, user_ids=None):
+        with self.lock:
+            self.generation += 1
+            if user_ids is None:
+                self.entries.clear()
+            else:
+                for user_id in user_ids:
+                    self.entries.pop(user_id, None)
+
+
+user_cache = UserCache()
+
+
+def load_session_user(user_id):
+    """пользователь с профилем одним запросом, отсоединенный от сессии для кеша"""
+    user = User.query.options(db.joinedload(User.profile)).filter_by(id=user_id).first()
+    if user:
+        if user.profile:
+            db.session.expunge(user.profile)
+        db.session.expunge(user)
+    return user
+
+
+def queue_user_cache_invalidation(user_ids=None):
+    """сбросить кеш пользователей после commit текущей транзакции; None - весь кеш
+
+    session_version растет в той же транзакции, поэтому остальные процессы перечитают
+    пользователей на следующем запросе
+    """
+    update = db.update(User).values(session_version=User.session_version + 1)
+    if user_ids is not None:
+        user_ids = set(user_ids)
+        update = update.where(User.id.in_(user_ids))
+    db.session.execute(update.execution_options(synchronize_session=False))
+    db.session.info.setdefault('user_cache_invalidations', []).append(user_ids)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def apply_user_cache_invalidations(session):
+    for user_ids in session.info.pop('user_cache_invalidations', []):
+        user_cache.invalidate(user_ids)
+
+
+@db.event.listens_for(db.session, 'after_transaction_end')
+def restore_session_user(session, transaction):
+    """commit и rollback помечают устаревшими все объекты сессии, в том числе current_user;
+    пока запись кеша действует (сброс применяется раньше, в after_commit), ее значения
+    возвращаются в объект без SQL
+    """
+    if transaction.parent is not None or not has_request_context():
+        return
+    user = g.get('session_user')
+    if user is None or not user_cache.holds(user):
+        return
+    merged = session.identity_map.get(db.inspect(user).key)
+    if merged is not None and db.inspect(merged).expired_attributes:
+        session.merge(user, load=False)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_user_cache_invalidations(session):
+    session.info.pop('user_cache_invalidations', None)
+
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    """заблокированный или удаленный пользователь теряет сессию на следующем запросе
+
+    на каждый запрос читаются только is_active и session_version по первичному ключу,
+    пользователь с профилем берется из кеша, пока версия не изменилась
+    """
+    user_id = int(user_id)
+    state = db.session.execute(
+        db.select(User.is_active, User.session_version).where(User.id == user_id)
+    ).first()
+    if not state or not state.is_active:
+        return None
+    user = user_cache.get(user_id, state.session_version, load_session_user)
+    if not user:
+        return None
+    g.session_user = user
+    return db.session.merge(user, load=False)
 
 
 # функция для запроса уведомлений
 def notifications_query(user_id):
-    return Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()).limit(5).all()
+    """последние уведомления для меню навигации, один запрос на запрос страницы"""
+    request_cache = g.setdefault('recent_notifications', {})
+    if user_id not in request_cache:
+        request_cache[user_id] = Notification.query.filter_by(user_id=user_id).order_by(
+            Notification.created_at.desc()).limit(5).all()
+    return request_cache[user_id]
 
 
+# расчет рейтинга фрилансера
 def get_freelancer_rating(freelancer_id):
-    reviews = Review.query.filter_by(freelancer_id=freelancer_id).all()
-    if not reviews:
-        return 0
-    return sum(review.rating for review in reviews) / len(reviews)
+    user = db.session.get(User, freelancer_id)
+    return user.freelancer_rating if user else 0
+
+
+def update_rating_aggregates(user_ids=None, invalidate_sessions=True):
+    """пересчитывает агрегаты рейтинга набором UPDATE-запросов (без загрузки отзывов в python)
+
+    user_ids - ограничить пересчет этими пользователями, None - все пользователи;
+    invalidate_sessions=False - не трогать session_version (миграции до появления поля)
+    """
+    where = ''
+    params = {}
+    if user_ids is not None:
+        user_ids = [user_id for user_id in set(user_ids) if user_id]
+        if not user_ids:
+            return
+        params = {f'u{i}': user_id for i, user_id in enumerate(user_ids)}
+        where = 'AND user.id IN (' + ', '.join(f':{key}' for key in params) + ')'
+
+    db.session.flush()
+    db.session.execute(text(f"""
+        UPDATE user SET rating_count = 0, rating_sum = 0, client_rating_count = 0, client_rating_sum = 0
+        WHERE 1 = 1 {where}
+    """), params)
+    db.session.execute(text(f"""
+        UPDATE user SET rating_count = agg.cnt, rating_sum = agg.total
+        FROM (SELECT freelancer_id, COUNT(*) AS cnt, SUM(rating) AS total
+              FROM review GROUP BY freelancer_id) AS agg
+        WHERE user.id = agg.freelancer_id {where}
+    """), params)
+    db.session.execute(text(f"""
+        UPDATE user SET client_rating_count = agg.cnt, client_rating_sum = agg.total
+        FROM (SELECT project.client_id AS client_id, COUNT(*) AS cnt, SUM(review.rating) AS total
+              FROM review JOIN project ON project.id = review.project_id
+              GROUP BY project.client_id) AS agg
+        WHERE user.id = agg.client_id {where}
+    """), params)
+    db.session.expire_all()
+    if invalidate_sessions:
+        queue_user_cache_invalidation(user_ids)
+
+
+def rebuild_rating_aggregates():
+    """восстановление агрегатов рейтинга для существующей базы"""
+    with app.app_context():
+        update_rating_aggregates()
+        db.session.commit()
+        print("✅ Агрегаты рейтинга пересчитаны")
+
+
+# постраничная навигация по ключу (created_at, id) вместо загрузки всех строк
+PER_PAGE = 30
+MAX_PER_PAGE = 100
+
+
+def get_per_page(default=PER_PAGE):
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    payload = json.dumps([sort_value, row_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(token, sort_column):
+    """токен следующей страницы -> (значение сортировки, id); None для первой или испорченной страницы"""
+    if not token:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        sort_value, row_id = json.loads(payload)
+        if isinstance(getattr(sort_column, 'type', None), db.DateTime):
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_paginate(query, sort_column, id_column, per_page=None, descending=True):
+    """одна страница запроса по ключу (sort_column, id_column) и токен следующей страницы
+
+    страница продолжается от значения ключа из параметра cursor, поэтому стоимость запроса
+    не зависит от номера страницы; если запрос выбирает несколько сущностей/колонок,
+    элементы страницы - кортежи
+    """
+    per_page = per_page or get_per_page()
+    cursor = decode_cursor(request.args.get('cursor'), sort_column)
+
+    if cursor:
+        key = db.tuple_(sort_column, id_column)
+        bound = db.tuple_(db.literal(cursor[0], type_=sort_column.type), db.literal(cursor[1]))
+        query = query.filter(key < bound if descending else key > bound)
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    rows = query.add_columns(sort_column, id_column).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1][-2], rows[-1][-1])
+
+    return [row[0] if len(row) == 3 else tuple(row[:-2]) for row in rows], next_cursor
+
+
+# счетчики непрочитанного для навигации: хранятся в базе и общие для всех процессов
+def count_unread_notifications(user_id):
+    return Notification.query.filter_by(user_id=user_id, is_read=False).count()
+
+
+def notification_counter_query(user_id):
+    return db.select(UserCounter.value).where(UserCounter.user_id == user_id, UserCounter.name == 'notifications')
+
+
+def fill_notification_counter(user_id):
+    """строка user_counter заполняется COUNT(*) одним INSERT ... SELECT при первом обращении
+
+    заполнение идет отдельной короткой транзакцией: дельты из параллельных транзакций
+    применяются только к существующей строке, поэтому INSERT под блокировкой записи их не теряет
+    """
+    if db.session.info.get('writing'):
+        # своя транзакция записи уже держит базу - считаем без сохранения
+        return count_unread_notifications(user_id)
+    with db.engine.begin() as connection:
+        connection.execute(sqlite_insert(UserCounter).from_select(
+            ['user_id', 'name', 'value'],
+            db.select(db.literal(user_id), db.literal('notifications'), db.func.count()).select_from(
+                Notification).where(Notification.user_id == user_id, Notification.is_read == False)  # noqa: E712
+        ).on_conflict_do_nothing())
+        return connection.scalar(notification_counter_query(user_id))
+
+
+def unread_messages_query(user_id):
+    """сумма счетчиков по диалогам пользователя, без подсчета строк message"""
+    return db.session.query(db.func.coalesce(db.func.sum(db.case(
+        (Conversation.user1_id == user_id, Conversation.user1_unread),
+        else_=Conversation.user2_unread
+    )), 0)).filter(
+        db.or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id)
+    )
+
+
+def count_unread_messages(user_id):
+    return unread_messages_query(user_id).scalar()
+
+
+def fill_user_counters():
+    """пересчитывает строки user_counter всех пользователей одним INSERT ... SELECT"""
+    db.session.execute(db.delete(UserCounter))
+    db.session.execute(db.insert(UserCounter).from_select(
+        ['user_id', 'name', 'value'],
+        db.select(User.id, db.literal('notifications'), db.select(db.func.count()).where(
+            Notification.user_id == User.id, Notification.is_read == False  # noqa: E712
+        ).scalar_subquery())
+    ))
+
+
+def get_unread_counter(user_id, name):
+    """счетчики навигации - из памяти запроса, иначе оба одним запросом
+
+    уведомления хранятся строкой user_counter, сообщения суммируются по сводкам диалогов
+    """
+    request_counters = g.setdefault('unread_counters', {})
+    if (user_id, name) not in request_counters:
+        notifications, messages = db.session.execute(db.select(
+            notification_counter_query(user_id).scalar_subquery(),
+            unread_messages_query(user_id).scalar_subquery()
+        )).one()
+        if notifications is None:
+            notifications = fill_notification_counter(user_id)
+        request_counters[(user_id, 'notifications')] = notifications
+        request_counters[(user_id, 'messages')] = messages
+    return request_counters[(user_id, name)]
+
+
+def queue_counter_update(user_id, name=None, delta=0, value=None):
+    """изменение счетчика уведомлений в той же транзакции (для массовых UPDATE/DELETE)
+
+    name=None - пересчитать счетчики пользователя, user_id=None - всех пользователей
+    """
+    db.session.info.setdefault('counter_updates', []).append((user_id, name, delta, value))
+
+
+def attribute_changed_to(obj, attribute, value):
+    history = db.inspect(obj).attrs[attribute].history
+    return value in history.added and value not in history.unchanged
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def collect_counter_updates(session, flush_context):
+    """изменения счетчиков от новых, прочитанных и удаленных уведомлений"""
+    updates = session.info.setdefault('counter_updates', [])
+    for obj in session.new:
+        if isinstance(obj, Notification) and not obj.is_read:
+            updates.append((obj.user_id, 'notifications', 1, None))
+    for obj in session.dirty:
+        if isinstance(obj, Notification) and attribute_changed_to(obj, 'is_read', True):
+            updates.append((obj.user_id, 'notifications', -1, None))
+    for obj in session.deleted:
+        if isinstance(obj, Notification) and not obj.is_read:
+            updates.append((obj.user_id, 'notifications', -1, None))
+
+
+@db.event.listens_for(db.session, 'before_commit')
+def apply_counter_updates(session):
+    """дельты транзакции - по одному UPDATE на счетчик; строки, которых еще нет, заполнит первое чтение"""
+    session.flush()  # изменения новых объектов собирает after_flush
+    changes = {}  # (user_id, name) -> (новое значение или None, дельта)
+    for user_id, name, delta, value in session.info.pop('counter_updates', []):
+        if user_id is None or name is None:
+            condition = True if user_id is None else UserCounter.user_id == user_id
+            session.execute(db.delete(UserCounter).where(condition))
+            changes = {key: change for key, change in changes.items() if user_id is not None and key[0] != user_id}
+            continue
+        current, current_delta = changes.get((user_id, name), (None, 0))
+        changes[(user_id, name)] = (value, 0) if value is not None else (current, current_delta + delta)
+    for (user_id, name), (value, delta) in changes.items():
+        base = UserCounter.value if value is None else value
+        if value is None and not delta:
+            continue
+        session.execute(db.update(UserCounter).where(
+            UserCounter.user_id == user_id, UserCounter.name == name
+        ).values(value=db.func.max(0, base + delta)))
+
+
+@db.event.listens_for(db.session, 'after_commit')
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_counter_updates(session):
+    session.info.pop('counter_updates', None)
+
+
+# кеш отрендеренных карточек проектов для главной и /projects
+PROJECT_CARD_CACHE_SIZE = 5000
+
+
+class FragmentCache:
+    """LRU готовых HTML-фрагментов, общий для всех запросов процесса
+
+    ключ содержит версию записи: после изменения проекта карточка рендерится заново под новым
+    ключом, а устаревшая вытесняется или удаляется после commit
+    """
+
+    def __init__(self, maxsize=PROJECT_CARD_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, render):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        value = render()
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, object_ids=None):
+        with self.lock:
+            if object_ids is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[1] in object_ids]:
+                    del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests * 100, 1) if requests else 0,
+            }
+
+
+project_card_cache = FragmentCache()
+
+
+def render_project_card(project, template_name='project_card.html'):
+    """карточка проекта из кеша; шаблон карточки зависит только от проекта и его заказчика"""
+    def render():
+        template = app.jinja_env.get_template(template_name)
+        return Markup(template.render(project=project, get_category_icon=get_category_icon))
+    return project_card_cache.get((template_name, project.id, project.version), render)
+
+
+@db.event.listens_for(db.session, 'before_flush')
+def bump_project_versions(session, flush_context, instances):
+    """версия страницы проекта: растет при изменении проекта, его откликов и отзывов"""
+    changed = {obj for obj in session.dirty
+               if isinstance(obj, Project) and session.is_modified(obj, include_collections=False)}
+    project_ids = {obj.project_id for obj in session.new | session.dirty | session.deleted
+                   if isinstance(obj, (ProjectResponse, Review)) and obj.project_id is not None}
+    with session.no_autoflush:
+        changed.update(filter(None, (session.get(Project, project_id) for project_id in project_ids)))
+    now = datetime.now(timezone.utc)
+    for project in changed:
+        if project in session.new or project in session.deleted:
+            continue
+        project.version = (project.version or 0) + 1
+        project.updated_at = now
+
+
+def touch_projects(project_ids):
+    """новая версия проектов при массовых UPDATE/DELETE откликов и отзывов, минуя ORM"""
+    db.session.execute(
+        db.update(Project).where(Project.id.in_(project_ids)).values(
+            version=Project.version + 1, updated_at=datetime.now(timezone.utc)
+        ).execution_options(synchronize_session=False)
+    )
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def collect_changed_projects(session, flush_context):
+    changed = session.info.setdefault('changed_projects', set())
+    changed.update(obj.id for obj in session.dirty | session.deleted if isinstance(obj, Project))
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def drop_stale_project_cards(session):
+    changed = session.info.pop('changed_projects', None)
+    if changed:
+        project_card_cache.invalidate(changed)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_changed_projects(session):
+    session.info.pop('changed_projects', None)
+
+
+# бюджет SQL-запросов на запрос: защита от N+1
+QUERY_BUDGETS = {}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    """декоратор маршрута: не больше limit SQL-запросов на запрос, независимо от числа строк на странице
+
+    при TESTING или QUERY_BUDGET_STRICT превышение - исключение (тест падает), иначе предупреждение в лог
+    """
+    def decorator(view):
+        QUERY_BUDGETS[view.__name__] = limit
+        return view
+    return decorator
+
+
+@sa_event.listens_for(Engine, 'before_cursor_execute')
+def count_request_statements(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+@sa_event.listens_for(Engine, 'after_cursor_execute')
+def time_request_statements(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('statement_started')
+    if started and has_request_context():
+        g.sql_time = g.get('sql_time', 0) + time.perf_counter() - started.pop()
+
+
+@sa_event.listens_for(Engine, 'handle_error')
+def discard_statement_timer(exception_context):
+    started = exception_context.connection.info.get('statement_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+@app.after_request
+def check_query_budget(response):
+    budget = QUERY_BUDGETS.get(request.endpoint)
+    statements = g.get('sql_statements', 0)
+    if budget is not None and statements > budget:
+        message = f'{request.endpoint}: {statements} SQL-запросов при бюджете {budget}'
+        if app.config.get('TESTING') or app.config.get('QUERY_BUDGET_STRICT'):
+            raise QueryBudgetExceeded(message)
+        print(f"⚠️ {message}")
+    return response
+
+
+# метрики запросов: Server-Timing и распределение времени по маршрутам
+METRICS_SAMPLES = 1000  # последние длительности на маршрут для перцентилей
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # секунды, для Prometheus
+
+
+class EndpointMetrics:
+    """длительность запросов по маршрутам в памяти процесса: счетчики, гистограмма и недавние значения"""
+
+    def __init__(self, samples=METRICS_SAMPLES, buckets=METRICS_BUCKETS):
+        self.samples = samples
+        self.buckets = buckets
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, duration, sql_time, sql_statements, render_time):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {
+                    'count': 0, 'duration_sum': 0.0, 'sql_time_sum': 0.0, 'sql_statements_sum': 0,
+                    'render_time_sum': 0.0, 'buckets': [0] * len(self.buckets), 'recent': deque(maxlen=self.samples)
+                }
+            stats['count'] += 1
+            stats['duration_sum'] += duration
+            stats['sql_time_sum'] += sql_time
+            stats['sql_statements_sum'] += sql_statements
+            stats['render_time_sum'] += render_time
+            bucket = bisect.bisect_left(self.buckets, duration)
+            if bucket < len(self.buckets):
+                stats['buckets'][bucket] += 1
+            stats['recent'].append(duration)
+
+    def snapshot(self):
+        """сводка по маршрутам: число запросов, перцентили и средние значения (мс)"""
+        with self.lock:
+            endpoints = {endpoint: dict(stats, recent=sorted(stats['recent']), buckets=list(stats['buckets']))
+                         for endpoint, stats in self.endpoints.items()}
+
+        def percentile(values, fraction):
+            return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else 0
+
+        summary = []
+        for endpoint, stats in sorted(endpoints.items()):
+            count = stats['count']
+            summary.append({
+                'endpoint': endpoint,
+                'count': count,
+                'p50_ms': round(percentile(stats['recent'], 0.50), 1),
+                'p95_ms': round(percentile(stats['recent'], 0.95), 1),
+                'p99_ms': round(percentile(stats['recent'], 0.99), 1),
+                'avg_sql_statements': round(stats['sql_statements_sum'] / count, 1),
+                'avg_sql_ms': round(stats['sql_time_sum'] / count * 1000, 1),
+                'avg_render_ms': round(stats['render_time_sum'] / count * 1000, 1),
+                'stats': stats,
+            })
+        return summary
+
+    def prometheus(self):
+        """текстовый формат Prometheus: гистограмма длительности и суммы SQL по маршрутам"""
+        lines = [
+            '# HELP http_request_duration_seconds Длительность обработки запроса',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        summary = self.snapshot()
+        for item in summary:
+            stats, label = item['stats'], f'endpoint="{item["endpoint"]}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, stats['buckets']):
+                cumulative += bucket_count
+                lines.append(f'http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats["count"]}')
+            lines.append(f'http_request_duration_seconds_sum{{{label}}} {stats["duration_sum"]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{label}}} {stats["count"]}')
+        for name, key, help_text in (
+            ('http_request_sql_seconds_total', 'sql_time_sum', 'Время SQL-запросов'),
+            ('http_request_sql_statements_total', 'sql_statements_sum', 'Число SQL-запросов'),
+            ('http_request_render_seconds_total', 'render_time_sum', 'Время рендеринга шаблонов'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            lines += [f'{name}{{endpoint="{item["endpoint"]}"}} {item["stats"][key]}' for item in summary]
+        return '\n'.join(lines) + '\n'
+
+
+endpoint_metrics = EndpointMetrics()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def stop_render_timer(sender, template, context, **extra):
+    if 'render_started' in g:
+        g.render_time = g.get('render_time', 0) + time.perf_counter() - g.pop('render_started')
+
+
+@app.after_request
+def record_request_timing(response):
+    if 'request_started' not in g:
+        return response
+    duration = time.perf_counter() - g.request_started
+    sql_time, sql_statements, render_time = g.get('sql_time', 0), g.get('sql_statements', 0), g.get('render_time', 0)
+
+    # время рендеринга включает SQL-запросы ленивой загрузки из шаблона
+    response.headers['Server-Timing'] = (
+        f'db;dur={sql_time * 1000:.1f};desc="SQL x{sql_statements}", '
+        f'render;dur={render_time * 1000:.1f}, total;dur={duration * 1000:.1f}'
+    )
+    endpoint_metrics.record(request.endpoint or 'unknown', duration, sql_time, sql_statements, render_time)
+    return response
+
+
+# условные GET-запросы: 304 Not Modified без выполнения шаблона
+def viewer_state():
+    """данные текущего пользователя, которые попадают в любую страницу (навигация)"""
+    if not current_user.is_authenticated:
+        return ('anonymous',)
+    recent = tuple((n.id, n.is_read, n.unread_count) for n in notifications_query(current_user.id))
+    return (current_user.id, current_user.is_client, current_user.is_moderator,
+            get_unread_counter(current_user.id, 'notifications'), get_unread_counter(current_user.id, 'messages'),
+            recent)
+
+
+def not_modified(*versions, last_modified=None):
+    """ответ 304, если копия клиента актуальна, иначе None
+
+    ETag строится из версий данных страницы и состояния пользователя; Last-Modified отдается
+    только анонимным посетителям - для них страница зависит только от данных
+    """
+    if '_flashes' in flask_session:
+        return None  # flash-сообщение показывается один раз - страницу нужно отрендерить
+    etag = hashlib.sha1(repr((request.full_path, versions, viewer_state())).encode()).hexdigest()[:27]
+    if last_modified is not None:
+        if current_user.is_authenticated:
+            last_modified = None
+        elif last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+    g.conditional = (etag, last_modified)
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since:
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        fresh = False
+    return Response(status=304) if fresh else None
+
+
+@app.after_request
+def add_validators(response):
+    if 'conditional' in g and response.status_code in (200, 304):
+        etag, last_modified = g.conditional
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+    return response
+
+
+def get_category_icon(category):
+    icons = {
+        'Разработка': '💻',
+        'Дизайн': '🎨',
+        'Маркетинг': '📈',
+        'Тексты': '✍️',
+        'Консультация': '💬',
+        'Администрирование': '⚙️'
+    }
+    return icons.get(category, '🔧')
 
 
 # контекстный процессор
 @app.context_processor
 def utility_processor():
-    def get_category_icon(category):
-        icons = {
-            'Разработка': '💻',
-            'Дизайн': '🎨',
-            'Маркетинг': '📈',
-            'Тексты': '✍️',
-            'Консультация': '💬',
-            'Администрирование': '⚙️'
-        }
-        return icons.get(category, '🔧')
-
     def get_unread_notifications_count():
         if current_user.is_authenticated:
-            return Notification.query.filter_by(user_id=current_user.id, is_read=False).count()
+            return get_unread_counter(current_user.id, 'notifications')
         return 0
 
     def get_notification_icon(notification_type):
@@ -208,17 +1391,19 @@ def utility_processor():
         }
         return colors.get(notification_type, 'secondary')
 
+    def page_url(cursor=None):
+        """ссылка на страницу текущего списка с теми же фильтрами"""
+        args = request.args.to_dict(flat=False)
+        args.pop('cursor', None)
+        if cursor:
+            args['cursor'] = cursor
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
     def get_unread_messages_count():
         if current_user.is_authenticated:
-            return Message.query.filter_by(receiver_id=current_user.id, is_read=False).count()
+            return get_unread_counter(current_user.id, 'messages')
         return 0
 
-    def get_freelancer_rating(freelancer_id):
-        reviews = Review.query.filter_by(freelancer_id=freelancer_id).all()
-        if not reviews:
-            return 0
-        return sum(review.rating for review in reviews) / len(reviews)
-
     return dict(
         get_category_icon=get_category_icon,
         get_unread_notifications_count=get_unread_notifications_count,
@@ -226,12 +1411,15 @@ def utility_processor():
         get_notification_color=get_notification_color,
         get_unread_messages_count=get_unread_messages_count,  # ← ДОБАВЬТЕ ЗАПЯТУЮ ЗДЕСЬ
         get_freelancer_rating=get_freelancer_rating,
-        notifications_query=notifications_query
+        notifications_query=notifications_query,
+        render_project_card=render_project_card,
+        page_url=page_url
     )
 
 
 # основные маршруты
 @app.route('/')
+@query_budget(5)
 def index():
     projects = Project.query.filter_by(status='open').order_by(Project.created_at.desc()).limit(6).all()
     return render_template('index.html', projects=projects)
@@ -239,6 +1427,7 @@ def index():
 
 @app.route('/profile/<int:user_id>')
 @login_required
+@query_budget(10)
 def user_profile(user_id):
     """Просмотр профиля другого пользователя"""
     user = User.query.get_or_404(user_id)
@@ -261,10 +1450,7 @@ def user_profile(user_id):
 
         total_budget = sum(project.budget for project in user_projects_completed)
 
-        client_reviews = Review.query.join(Project).filter(
-            Project.client_id == user.id
-        ).all()
-        client_rating = sum(review.rating for review in client_reviews) / len(client_reviews) if client_reviews else 0
+        client_rating = user.client_rating
 
         return render_template('user_profile.html',
                                user=user,
@@ -274,17 +1460,19 @@ def user_profile(user_id):
                                client_rating=client_rating)
     else:
         # для фрилансера
-        freelancer_projects_active = Project.query.filter(
+        freelancer_projects_active = Project.query.options(db.joinedload(Project.client)).filter(
             Project.freelancer_id == user.id,
             Project.status == 'in_progress'
         ).order_by(Project.created_at.desc()).limit(10).all()
 
-        freelancer_projects_completed = Project.query.filter(
+        freelancer_projects_completed = Project.query.options(db.joinedload(Project.client)).filter(
             Project.freelancer_id == user.id,
             Project.status == 'completed'
         ).order_by(Project.completed_at.desc()).limit(10).all()
 
-        freelancer_reviews = Review.query.filter_by(
+        freelancer_reviews = Review.query.options(
+            db.joinedload(Review.project), db.joinedload(Review.reviewer)
+        ).filter_by(
             freelancer_id=user.id
         ).order_by(Review.created_at.desc()).all()
 
@@ -328,6 +1516,17 @@ def create_review(project_id):
         )
         db.session.add(review)
 
+        # агрегаты рейтинга обновляем в той же транзакции
+        User.query.filter_by(id=project.freelancer_id).update({
+            'rating_count': User.rating_count + 1,
+            'rating_sum': User.rating_sum + review.rating
+        })
+        User.query.filter_by(id=project.client_id).update({
+            'client_rating_count': User.client_rating_count + 1,
+            'client_rating_sum': User.client_rating_sum + review.rating
+        })
+        queue_user_cache_invalidation([project.freelancer_id, project.client_id])
+
         # уведомляем фрилансера
         notification = Notification(
             user_id=project.freelancer_id,
@@ -345,14 +1544,6 @@ def create_review(project_id):
 
     return render_template('create_review.html', project=project)
 
-
-# расчет рейтинга фрилансера
-def get_freelancer_rating(freelancer_id):
-    reviews = Review.query.filter_by(freelancer_id=freelancer_id).all()
-    if not reviews:
-        return 0
-    return sum(review.rating for review in reviews) / len(reviews)
-
 @app.route('/project/<int:project_id>/reject_response/<int:response_id>')
 @login_required
 def reject_project_response(project_id, response_id):
@@ -382,6 +1573,122 @@ def reject_project_response(project_id, response_id):
     flash('❌ Отклик отклонен')
     return redirect(url_for('project_detail', project_id=project_id))
 
+# пароли: хеширование в ограниченном пуле и защита входа от перебора
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+PASSWORD_HASH_QUEUE = PASSWORD_HASH_WORKERS * 4  # хеши в работе и в очереди
+PASSWORD_HASH_WAIT = 2  # секунды ожидания места в очереди, затем 503
+LOGIN_FAILURE_WINDOW = 15 * 60
+LOGIN_FAILURE_LIMITS = {'ip': 30, 'email': 10}  # неудачных входов за окно
+LOGIN_LIMITER_SIZE = 100000  # ключей в памяти, старые вытесняются
+
+password_hash_prefixes = {}
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=app.config['PASSWORD_HASH_METHOD'])
+
+
+def password_needs_rehash(password_hash):
+    """хеш посчитан с другими параметрами, чем PASSWORD_HASH_METHOD"""
+    method = app.config['PASSWORD_HASH_METHOD']
+    if method not in password_hash_prefixes:
+        # 'scrypt' и 'scrypt:32768:8:1' дают одинаковый префикс - сравниваем с тем, что пишет werkzeug
+        password_hash_prefixes[method] = hash_password('').split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != password_hash_prefixes[method]
+
+
+class PasswordHasherBusy(Exception):
+    """очередь хеширования заполнена"""
+
+
+class PasswordHasher:
+    """хеширование и проверка паролей в пуле из workers потоков
+
+    scrypt/pbkdf2 отпускают GIL, поэтому остальные запросы обслуживаются, пока считаются хеши,
+    а одновременно считается не больше workers хешей; если в работе и в очереди уже max_pending,
+    новая задача ждет не дольше wait секунд и получает PasswordHasherBusy
+    """
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_QUEUE, wait=PASSWORD_HASH_WAIT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.wait = wait
+
+    def run(self, function, *args):
+        if not self.slots.acquire(timeout=self.wait):
+            raise PasswordHasherBusy()
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self.run(hash_password, password)
+
+    def verify(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
+
+
+password_hasher = PasswordHasher()
+
+
+class LoginLimiter:
+    """неудачные попытки входа по IP и по email в памяти процесса
+
+    ключ, набравший limits[вид] неудач за window секунд, блокируется до истечения окна
+    самой старой из них - такие попытки отклоняются до поиска пользователя и расчета хеша
+    """
+
+    def __init__(self, limits=LOGIN_FAILURE_LIMITS, window=LOGIN_FAILURE_WINDOW, maxsize=LOGIN_LIMITER_SIZE):
+        self.limits = limits
+        self.window = window
+        self.maxsize = maxsize
+        self.failures = OrderedDict()  # (вид, значение) -> deque времен последних неудач
+        self.lock = threading.Lock()
+
+    def retry_after(self, keys):
+        """секунды до снятия блокировки; 0 - попытку можно проверять"""
+        now = time.monotonic()
+        wait = 0
+        with self.lock:
+            for key in keys:
+                attempts = self.failures.get(key)
+                if attempts and len(attempts) == attempts.maxlen:
+                    wait = max(wait, attempts[0] + self.window - now)
+        return math.ceil(wait) if wait > 0 else 0
+
+    def fail(self, keys):
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                attempts = self.failures.pop(key, None) or deque(maxlen=self.limits[key[0]])
+                attempts.append(now)
+                self.failures[key] = attempts
+            while len(self.failures) > self.maxsize:
+                self.failures.popitem(last=False)
+
+    def reset(self, key):
+        with self.lock:
+            self.failures.pop(key, None)
+
+
+login_limiter = LoginLimiter()
+
+
+def rehash_password(user, password):
+    """пересчитать хеш после успешного входа, если сменился PASSWORD_HASH_METHOD
+
+    при заполненной очереди пересчет откладывается до следующего входа
+    """
+    if not password_needs_rehash(user.password_hash):
+        return
+    try:
+        user.password_hash = password_hasher.hash(password)
+    except PasswordHasherBusy:
+        return
+    db.session.commit()
+
+
 @app.route('/about')
 def about():
     """Страница "О проекте" """
@@ -405,9 +1712,15 @@ def register():
             email=email,
             is_client=(user_type == 'client')
         )
-        user.password_hash = generate_password_hash(password)
+        try:
+            user.password_hash = password_hasher.hash(password)
+        except PasswordHasherBusy:
+            flash('Сервер перегружен, повторите регистрацию через несколько секунд')
+            return render_template('register.html'), 503, {'Retry-After': str(PASSWORD_HASH_WAIT)}
 
         db.session.add(user)
+        db.session.flush()
+        db.session.add(UserCounter(user_id=user.id, name='notifications', value=0))
         db.session.commit()
 
         # Для фрилансеров - редирект на создание профиля
@@ -449,7 +1762,7 @@ def create_moderator_if_needed():
                 email='moderator@test.ru',
                 is_moderator=True
             )
-            moderator.password_hash = generate_password_hash('moderator123')
+            moderator.password_hash = hash_password('moderator123')
             db.session.add(moderator)
             db.session.commit()
             print("✅ Создан новый модератор: moderator@test.ru / moderator123")
@@ -463,13 +1776,45 @@ def create_moderator_if_needed():
 # Маршруты управления пользователями для модератора
 @app.route('/admin/users')
 @login_required
+@query_budget(6)
 def admin_users():
     if not current_user.is_moderator:
         flash('Доступ запрещен')
         return redirect(url_for('index'))
 
-    users = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin_users.html', users=users)
+    sort = request.args.get('sort', 'created')
+    query, project_count = admin_users_query()
+    sort_column = project_count if sort == 'projects' else User.created_at
+
+    users, next_cursor = keyset_paginate(query, sort_column, User.id)
+    return render_template('admin_users.html', users=users, sort=sort, next_cursor=next_cursor)
+
+
+def admin_users_query():
+    """пользователи с числом проектов заказчика и исполнителя - один запрос с группирующими подзапросами
+
+    возвращает запрос строк (User, client_projects, freelancer_projects) и выражение
+    "число проектов по типу пользователя" для сортировки
+    """
+    client_counts = db.session.query(
+        Project.client_id.label('user_id'), db.func.count().label('project_count')
+    ).group_by(Project.client_id).subquery()
+    freelancer_counts = db.session.query(
+        Project.freelancer_id.label('user_id'), db.func.count().label('project_count')
+    ).filter(Project.freelancer_id.isnot(None)).group_by(Project.freelancer_id).subquery()
+
+    client_projects = db.func.coalesce(client_counts.c.project_count, 0)
+    freelancer_projects = db.func.coalesce(freelancer_counts.c.project_count, 0)
+    project_count = db.case((User.is_client == True, client_projects), else_=freelancer_projects)  # noqa: E712
+
+    query = db.session.query(
+        User, client_projects.label('client_projects'), freelancer_projects.label('freelancer_projects')
+    ).outerjoin(
+        client_counts, client_counts.c.user_id == User.id
+    ).outerjoin(
+        freelancer_counts, freelancer_counts.c.user_id == User.id
+    )
+    return query, project_count
 
 
 @app.route('/admin/user/<int:user_id>/toggle_ban')
@@ -499,6 +1844,7 @@ def admin_toggle_ban_user(user_id):
         )
         db.session.add(notification)
 
+    queue_user_cache_invalidation([user.id])
     db.session.commit()
 
     flash(f'Пользователь {user.username} {status}')
@@ -519,55 +1865,45 @@ def admin_delete_user(user_id):
         flash('Нельзя удалить другого модератора')
         return redirect(url_for('admin_users'))
 
+    if running_deletion('user', user.id):
+        flash(f'Пользователь {user.username} уже удаляется')
+        return redirect(url_for('admin_users'))
+
     # Собираем информацию для лога
     username = user.username
     projects_count = Project.query.filter_by(client_id=user.id).count()
     responses_count = ProjectResponse.query.filter_by(freelancer_id=user.id).count()
 
-    # Удаляем связанные данные пользователя
-    # 1. Уведомления
-    Notification.query.filter_by(user_id=user.id).delete()
-
-    # 2. Сообщения
-    Message.query.filter_by(sender_id=user.id).delete()
-    Message.query.filter_by(receiver_id=user.id).delete()
-
-    # 3. Отклики на проекты
-    ProjectResponse.query.filter_by(freelancer_id=user.id).delete()
-
-    # 4. Профиль
-    if user.profile:
-        db.session.delete(user.profile)
-
-    # 5. Отзывы
-    Review.query.filter_by(reviewer_id=user.id).delete()
-    Review.query.filter_by(freelancer_id=user.id).delete()
-
-    # 6. Обращения в поддержку
-    SupportTicket.query.filter_by(user_id=user.id).delete()
-    TicketMessage.query.filter_by(user_id=user.id).delete()
-
-    # 7. Проекты пользователя (если он заказчик)
-    user_projects = Project.query.filter_by(client_id=user.id).all()
-    for project in user_projects:
-        # Удаляем отклики на эти проекты
-        ProjectResponse.query.filter_by(project_id=project.id).delete()
-        # Удаляем отзывы на эти проекты
-        Review.query.filter_by(project_id=project.id).delete()
-        # Удаляем проект
-        db.session.delete(project)
-
-    # 8. Удаляем самого пользователя
-    db.session.delete(user)
+    # пользователи, чьи рейтинги изменятся после удаления отзывов
+    rated_users = db.session.query(Review.freelancer_id, Project.client_id).join(
+        Project, Project.id == Review.project_id
+    ).filter(
+        db.or_(Review.reviewer_id == user.id, Review.freelancer_id == user.id, Project.client_id == user.id)
+    ).all()
+
+    # строки удаляет фоновое задание порциями; оценка объема считается до записи
+    start_deletion_job('user', user.id, username,
+                       {user_id for row in rated_users for user_id in row} - {user.id})
+
+    # сразу: вход заблокирован, открытые проекты скрыты, страницы затронутых проектов обновятся
+    user.is_active = False
+    db.session.execute(db.update(Project).where(Project.client_id == user.id, Project.status == 'open').values(
+        status='hidden', version=Project.version + 1, updated_at=datetime.now(timezone.utc)
+    ).execution_options(synchronize_session=False))
+    touch_projects(db.select(ProjectResponse.project_id).where(ProjectResponse.freelancer_id == user.id))
+    touch_projects(db.select(Review.project_id).where(
+        db.or_(Review.reviewer_id == user.id, Review.freelancer_id == user.id)))
+    queue_user_cache_invalidation([user.id])
     db.session.commit()
 
-    flash(f'Пользователь {username} удален (проектов: {projects_count}, откликов: {responses_count})')
+    flash(f'Пользователь {username} заблокирован и удаляется в фоне (проектов: {projects_count}, откликов: {responses_count})')
     return redirect(url_for('admin_users'))
 
 
 # Маршруты управления проектами для модератора
 @app.route('/admin/projects')
 @login_required
+@query_budget(6)
 def admin_projects():
     if not current_user.is_moderator:
         flash('Доступ запрещен')
@@ -581,11 +1917,10 @@ def admin_projects():
     if status_filter != 'all':
         query = query.filter_by(status=status_filter)
 
-    if search:
-        query = query.filter(Project.title.contains(search) | Project.description.contains(search))
-
-    projects = query.order_by(Project.created_at.desc()).all()
-    return render_template('admin_projects.html', projects=projects, status_filter=status_filter, search=search)
+    query = query.options(db.joinedload(Project.client), db.joinedload(Project.freelancer))
+    projects, next_cursor = paginate_projects(query, search)
+    return render_template('admin_projects.html', projects=projects, status_filter=status_filter, search=search,
+                           next_cursor=next_cursor)
 
 
 @app.route('/admin/project/<int:project_id>/delete')
@@ -601,31 +1936,28 @@ def admin_delete_project(project_id):
     project_title = project.title
     client_username = project.client.username
 
-    # Удаляем связанные данные проекта
-    # 1. Отклики на проект
-    ProjectResponse.query.filter_by(project_id=project_id).delete()
-
-    # 2. Отзывы на проект
-    Review.query.filter_by(project_id=project_id).delete()
+    if running_deletion('project', project.id):
+        flash(f'Проект "{project_title}" уже удаляется')
+        return redirect(url_for('admin_projects'))
 
-    # 3. Уведомления, связанные с проектом
-    Notification.query.filter_by(related_id=project_id).delete()
+    # отклики, отзывы, уведомления и сам проект удаляет фоновое задание; рейтинги пересчитаются в конце
+    rated_users = {review.freelancer_id for review in project.reviews}
+    start_deletion_job('project', project.id, project_title,
+                       rated_users | {project.client_id} if rated_users else ())
 
-    # 4. Удаляем сам проект
-    db.session.delete(project)
-    db.session.commit()
+    # до удаления проект скрыт из списков
+    project.status = 'hidden'
 
-    # Создаем уведомление для владельца проекта
-    notification = Notification(
-        user_id=project.client_id,
+    # Создаем уведомление для владельца проекта в той же транзакции
+    enqueue_notification(
+        [project.client_id],
         title='Проект удален модератором',
         message=f'Ваш проект "{project_title}" был удален модератором за нарушение правил платформы.',
         notification_type='warning'
     )
-    db.session.add(notification)
     db.session.commit()
 
-    flash(f'Проект "{project_title}" (автор: {client_username}) удален')
+    flash(f'Проект "{project_title}" (автор: {client_username}) скрыт и удаляется в фоне')
     return redirect(url_for('admin_projects'))
 
 
@@ -637,6 +1969,9 @@ def admin_toggle_project_status(project_id):
         return redirect(url_for('index'))
 
     project = Project.query.get_or_404(project_id)
+    if running_deletion('project', project.id):
+        flash(f'Проект "{project.title}" удаляется')
+        return redirect(url_for('admin_projects'))
 
     # Переключаем статус проекта
     if project.status == 'open':
@@ -649,16 +1984,13 @@ def admin_toggle_project_status(project_id):
         flash('Нельзя изменить статус проекта в работе или завершенного')
         return redirect(url_for('admin_projects'))
 
-    db.session.commit()
-
-    # Уведомление владельцу проекта
-    notification = Notification(
-        user_id=project.client_id,
+    # Уведомление владельцу проекта в той же транзакции
+    enqueue_notification(
+        [project.client_id],
         title=f'Проект {status_msg}',
         message=f'Ваш проект "{project.title}" был {status_msg} модератором.',
         notification_type='warning' if status_msg == 'скрыт' else 'system'
     )
-    db.session.add(notification)
     db.session.commit()
 
     flash(f'Проект "{project.title}" {status_msg}')
@@ -670,15 +2002,30 @@ def login():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
+        limiter_keys = [('ip', request.remote_addr), ('email', email.strip().lower())]
+
+        retry_after = login_limiter.retry_after(limiter_keys)
+        if retry_after:
+            flash(f'Слишком много неудачных попыток входа. Повторите через {math.ceil(retry_after / 60)} мин.')
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
+
         user = User.query.filter_by(email=email).first()
+        try:
+            valid = bool(user and user.password_hash) and password_hasher.verify(user.password_hash, password)
+        except PasswordHasherBusy:
+            flash('Сервер перегружен, повторите вход через несколько секунд')
+            return render_template('login.html'), 503, {'Retry-After': str(PASSWORD_HASH_WAIT)}
 
-        if user and check_password_hash(user.password_hash, password):
+        if valid:
+            login_limiter.reset(limiter_keys[1])
             if not user.is_active:
                 flash('Ваш аккаунт заблокирован')
                 return redirect(url_for('login'))
+            rehash_password(user, password)
             login_user(user)
             return redirect(url_for('index'))
         else:
+            login_limiter.fail(limiter_keys)
             flash('Неверный email или пароль')
 
     return render_template('login.html')
@@ -708,16 +2055,20 @@ def create_profile():
             experience=request.form['experience']
         )
         db.session.add(profile)
-        db.session.commit()
+
+        # профиль виден на страницах проектов: заказчика - в карточке заказчика, фрилансера - в откликах
+        touch_projects(db.select(Project.id).where(
+            db.or_(Project.client_id == current_user.id, Project.freelancer_id == current_user.id)
+        ).union(db.select(ProjectResponse.project_id).where(ProjectResponse.freelancer_id == current_user.id)))
+        queue_user_cache_invalidation([current_user.id])
 
         # уведомление о создании профиля
-        profile_notification = Notification(
-            user_id=current_user.id,
+        enqueue_notification(
+            [current_user.id],
             title='Профиль создан!',
             message='Ваш профиль успешно создан. Теперь вы можете искать проекты или создавать свои.',
             notification_type='system'
         )
-        db.session.add(profile_notification)
         db.session.commit()
 
         flash('Профиль создан!')
@@ -728,6 +2079,7 @@ def create_profile():
 
 @app.route('/profile')
 @login_required
+@query_budget(9)
 def view_profile():
     # для фрилансеров без профиля - редирект на создание
     if not current_user.is_client and not current_user.profile:
@@ -735,12 +2087,12 @@ def view_profile():
 
     if current_user.is_client:
         # для заказчика
-        user_projects_active = Project.query.filter(
+        user_projects_active = Project.query.options(db.joinedload(Project.freelancer)).filter(
             Project.client_id == current_user.id,
             Project.status.in_(['open', 'in_progress'])
         ).order_by(Project.created_at.desc()).all()
 
-        user_projects_completed = Project.query.filter(
+        user_projects_completed = Project.query.options(db.joinedload(Project.freelancer)).filter(
             Project.client_id == current_user.id,
             Project.status == 'completed'
         ).order_by(Project.completed_at.desc()).all()
@@ -749,10 +2101,7 @@ def view_profile():
         total_budget = sum(project.budget for project in user_projects_completed)
 
         # рейтинг заказчика
-        client_reviews = Review.query.join(Project).filter(
-            Project.client_id == current_user.id
-        ).all()
-        client_rating = sum(review.rating for review in client_reviews) / len(client_reviews) if client_reviews else 0
+        client_rating = current_user.client_rating
 
         return render_template('view_profile.html',
                                user_projects_active=user_projects_active,
@@ -761,17 +2110,19 @@ def view_profile():
                                client_rating=client_rating)
     else:
         # для фрилансера
-        freelancer_projects_active = Project.query.filter(
+        freelancer_projects_active = Project.query.options(db.joinedload(Project.client)).filter(
             Project.freelancer_id == current_user.id,
             Project.status == 'in_progress'
         ).order_by(Project.created_at.desc()).all()
 
-        freelancer_projects_completed = Project.query.filter(
+        freelancer_projects_completed = Project.query.options(db.joinedload(Project.client)).filter(
             Project.freelancer_id == current_user.id,
             Project.status == 'completed'
         ).order_by(Project.completed_at.desc()).all()
 
-        freelancer_reviews = Review.query.filter_by(
+        freelancer_reviews = Review.query.options(
+            db.joinedload(Review.project), db.joinedload(Review.reviewer)
+        ).filter_by(
             freelancer_id=current_user.id
         ).order_by(Review.created_at.desc()).all()
 
@@ -783,6 +2134,7 @@ def view_profile():
 
 
 @app.route('/projects')
+@query_budget(6)
 def projects():
     category = request.args.get('category')
     search = request.args.get('search')
@@ -804,11 +2156,17 @@ def projects():
 
     if category:
         query = query.filter(Project.category.contains(category))
-    if search:
-        query = query.filter(Project.title.contains(search) | Project.description.contains(search))
 
-    projects = query.order_by(Project.created_at.desc()).all()
-    return render_template('projects.html', projects=projects, status_filter=status_filter)
+    # ?skill=python,flask или ?skill=python&skill=flask; skill_mode=any - хотя бы один навык
+    skills = parse_skills(','.join(request.args.getlist('skill')))
+    if skills:
+        query = filter_by_skills(query, skills, match_all=request.args.get('skill_mode') != 'any')
+    projects, next_cursor = paginate_projects(query.options(db.joinedload(Project.client)), search)
+    unchanged = not_modified([(project.id, project.version) for project in projects], next_cursor)
+    if unchanged:
+        return unchanged
+    return render_template('projects.html', projects=projects, status_filter=status_filter,
+                           next_cursor=next_cursor)
 
 
 @app.route('/projects/create', methods=['GET', 'POST'])
@@ -828,17 +2186,16 @@ def create_project():
             client_id=current_user.id
         )
         db.session.add(project)
-        db.session.commit()
+        db.session.flush()  # нужен id проекта
 
         # уведомление о создании проекта
-        project_notification = Notification(
-            user_id=current_user.id,
+        enqueue_notification(
+            [current_user.id],
             title='Проект опубликован!',
             message=f'Ваш проект "{project.title}" успешно опубликован.',
             notification_type='system',
             related_id=project.id
         )
-        db.session.add(project_notification)
         db.session.commit()
 
         flash('Проект создан!')
@@ -848,8 +2205,21 @@ def create_project():
 
 
 @app.route('/project/<int:project_id>')
+@query_budget(8)
 def project_detail(project_id):
-    project = Project.query.get_or_404(project_id)
+    # версия проекта учитывает отклики и отзывы, поэтому для 304 хватает одной строки
+    version, updated_at = Project.query.with_entities(Project.version, Project.updated_at).filter_by(
+        id=project_id).first_or_404()
+    unchanged = not_modified(version, last_modified=updated_at)
+    if unchanged:
+        return unchanged
+
+    project = Project.query.options(
+        db.joinedload(Project.client).joinedload(User.profile),
+        db.joinedload(Project.freelancer),
+        db.selectinload(Project.responses).joinedload(ProjectResponse.freelancer).joinedload(User.profile),
+        db.selectinload(Project.reviews)
+    ).filter_by(id=project_id).first_or_404()
     return render_template('project_detail.html', project=project)
 
 
@@ -873,37 +2243,35 @@ def accept_project_response(project_id, response_id):
     # отклоняем остальные отклики
     other_responses = ProjectResponse.query.filter_by(project_id=project_id).filter(
         ProjectResponse.id != response_id
-    ).all()
+    )
+    rejected_freelancer_ids = [row.freelancer_id for row in other_responses.with_entities(ProjectResponse.freelancer_id)]
+    other_responses.update({'status': 'rejected'}, synchronize_session=False)
 
-    for other_response in other_responses:
-        other_response.status = 'rejected'
-        # уведомление другим фрилансерам
-        notification = Notification(
-            user_id=other_response.freelancer_id,
-            title='Отклик отклонен',
-            message=f'Ваш отклик на проект "{project.title}" был отклонен. Заказчик выбрал другого исполнителя.',
-            notification_type='project_response',
-            related_id=project.id
-        )
-        db.session.add(notification)
+    # уведомление другим фрилансерам
+    enqueue_notification(
+        rejected_freelancer_ids,
+        title='Отклик отклонен',
+        message=f'Ваш отклик на проект "{project.title}" был отклонен. Заказчик выбрал другого исполнителя.',
+        notification_type='project_response',
+        related_id=project.id
+    )
 
     # уведомление выбранному фрилансеру
-    accepted_notification = Notification(
-        user_id=response.freelancer_id,
+    enqueue_notification(
+        [response.freelancer_id],
         title='Ваш отклик принят!',
         message=f'Заказчик принял ваш отклик на проект "{project.title}". Начинайте работу!',
         notification_type='project_accepted',
         related_id=project.id
     )
-    db.session.add(accepted_notification)
 
     # автоматически создаем первое сообщение в чате
-    welcome_message = Message(
+    enqueue_outbox(
+        'send_message',
         sender_id=current_user.id,
         receiver_id=response.freelancer_id,
         content=f'Здравствуйте! Я принял ваш отклик на проект "{project.title}". Давайте обсудим детали сотрудничества.'
     )
-    db.session.add(welcome_message)
 
     db.session.commit()
 
@@ -1017,15 +2385,186 @@ def respond_to_project(project_id):
     return redirect(url_for('project_detail', project_id=project_id))
 
 
+# рекомендации проектов по навыкам профиля
+RECOMMENDATIONS_LIMIT = 10
+MAX_RECOMMENDATIONS = 50
+SKILL_INDEX_SYNC_SECONDS = 30  # как часто подтягивать изменения проектов из других процессов
+SKILL_INDEX_SYNC_OVERLAP = 5  # секунды: запас на расхождение часов процессов
+
+
+def parse_skills(text):
+    """навыки из строки через запятую: нижний регистр, без лишних пробелов"""
+    return frozenset(' '.join(skill.split()).lower() for skill in (text or '').split(',') if skill.strip())
+
+
+class SkillIndex:
+    """инвертированный индекс навыков открытых проектов: навык -> id проектов
+
+    строится одним запросом при первом обращении, затем обновляется по событиям сессии и
+    периодически догружает проекты, измененные другими процессами (по индексу updated_at)
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.project_skills = {}
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.loaded = False
+        self.synced_at = None
+        self.next_sync = 0
+
+    def add(self, project_id, skills):
+        self.remove(project_id)
+        if skills:
+            self.project_skills[project_id] = skills
+            for skill in skills:
+                self.postings.setdefault(skill, set()).add(project_id)
+
+    def remove(self, project_id):
+        for skill in self.project_skills.pop(project_id, ()):
+            postings = self.postings[skill]
+            postings.discard(project_id)
+            if not postings:
+                del self.postings[skill]
+
+    def apply(self, rows):
+        """rows: (id, status, skills_required); закрытые и скрытые проекты удаляются из индекса"""
+        with self.lock:
+            for project_id, status, skills_required in rows:
+                if status == 'open':
+                    self.add(project_id, parse_skills(skills_required))
+                else:
+                    self.remove(project_id)
+
+    def refresh(self):
+        """первая загрузка открытых проектов или догрузка изменений с последней синхронизации"""
+        if self.loaded and time.monotonic() < self.next_sync:
+            return
+        with self.refresh_lock:
+            now = time.monotonic()
+            if self.loaded and now < self.next_sync:
+                return
+            started = datetime.now(timezone.utc)
+            columns = db.session.query(Project.id, Project.status, Project.skills_required)
+            if not self.loaded:
+                rows = columns.filter(Project.status == 'open').all()
+                with self.lock:
+                    self.postings, self.project_skills = {}, {}
+            else:
+                since = self.synced_at - timedelta(seconds=SKILL_INDEX_SYNC_OVERLAP)
+                rows = columns.filter(Project.updated_at >= since).all()
+            self.apply(rows)
+            self.loaded = True
+            self.synced_at = started
+            self.next_sync = now + SKILL_INDEX_SYNC_SECONDS
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded = False
+
+    def recommend(self, skills, limit=RECOMMENDATIONS_LIMIT, exclude=()):
+        """лучшие проекты по косинусной близости TF-IDF векторов навыков
+
+        перебираются только проекты из списков навыков фрилансера, а не вся таблица
+        """
+        with self.lock:
+            total = len(self.project_skills)
+            idf = {skill: math.log((total + 1) / (len(self.postings[skill]) + 1)) + 1
+                   for skill in skills if skill in self.postings}
+            scores = {}
+            for skill, weight in idf.items():
+                for project_id in self.postings[skill]:
+                    scores[project_id] = scores.get(project_id, 0) + weight * weight
+            candidates = [(project_id, score) for project_id, score in scores.items() if project_id not in exclude]
+            best = heapq.nlargest(limit, candidates, key=lambda item: (item[1] / self.norm(item[0], total), item[0]))
+            profile_norm = math.sqrt(sum(weight * weight for weight in idf.values())) or 1
+            return [(project_id, round(score / self.norm(project_id, total) / profile_norm, 4),
+                     sorted(self.project_skills[project_id] & idf.keys()))
+                    for project_id, score in best]
+
+    def norm(self, project_id, total):
+        return math.sqrt(sum((math.log((total + 1) / (len(self.postings[skill]) + 1)) + 1) ** 2
+                             for skill in self.project_skills[project_id]))
+
+
+skill_index = SkillIndex()
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def collect_skill_index_changes(session, flush_context):
+    changes = session.info.setdefault('skill_index_changes', {})
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Project):
+            changes[obj.id] = (obj.id, obj.status, obj.skills_required)
+    for obj in session.deleted:
+        if isinstance(obj, Project):
+            changes[obj.id] = (obj.id, 'deleted', None)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def apply_skill_index_changes(session):
+    changes = session.info.pop('skill_index_changes', None)
+    if changes and skill_index.loaded:
+        skill_index.apply(changes.values())
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_skill_index_changes(session):
+    session.info.pop('skill_index_changes', None)
+
+
+@app.route('/api/recommendations')
+@login_required
+@query_budget(6)
+def recommended_projects():
+    """открытые проекты, подходящие под навыки профиля фрилансера"""
+    if current_user.is_client or not current_user.profile:
+        return jsonify({'projects': [], 'error': 'Рекомендации доступны фрилансерам с заполненным профилем'})
+
+    limit = min(request.args.get('limit', RECOMMENDATIONS_LIMIT, type=int) or RECOMMENDATIONS_LIMIT,
+                MAX_RECOMMENDATIONS)
+    skill_index.refresh()
+    responded = {project_id for project_id, in db.session.query(ProjectResponse.project_id).filter_by(
+        freelancer_id=current_user.id)}
+    ranked = skill_index.recommend(parse_skills(current_user.profile.skills), limit, exclude=responded)
+
+    # проекты, удаленные другим процессом, пропускаются и убираются из индекса
+    found = {project.id: project for project in Project.query.filter(
+        Project.id.in_([project_id for project_id, _, _ in ranked]), Project.status == 'open')}
+    skill_index.apply((project_id, 'deleted', None) for project_id, _, _ in ranked if project_id not in found)
+    return jsonify({'projects': [{
+        'id': project_id,
+        'title': found[project_id].title,
+        'budget': found[project_id].budget,
+        'category': found[project_id].category,
+        'score': score,
+        'matched_skills': matched,
+        'url': url_for('project_detail', project_id=project_id),
+    } for project_id, score, matched in ranked if project_id in found]})
+
+
 # уведомления
 @app.route('/notifications')
 @login_required
+@query_budget(7)
 def notifications():
-    user_notifications = Notification.query.filter_by(
-        user_id=current_user.id
-    ).order_by(Notification.created_at.desc()).all()
+    user_notifications, next_cursor = keyset_paginate(
+        Notification.query.filter_by(user_id=current_user.id),
+        Notification.created_at, Notification.id
+    )
+
+    # счетчики по всем уведомлениям, а не только по текущей странице
+    read_counts = dict(db.session.query(Notification.is_read, db.func.count()).filter(
+        Notification.user_id == current_user.id
+    ).group_by(Notification.is_read).all())
+    notification_counts = {
+        'total': sum(read_counts.values()),
+        'unread': read_counts.get(False, 0),
+        'read': read_counts.get(True, 0)
+    }
 
-    return render_template('notifications.html', notifications=user_notifications)
+    return render_template('notifications.html', notifications=user_notifications,
+                           notification_counts=notification_counts, next_cursor=next_cursor)
 
 
 # удаление уведомления
@@ -1066,6 +2605,7 @@ def delete_all_notifications():
     Notification.query.filter_by(
         user_id=current_user.id
     ).delete()
+    queue_counter_update(current_user.id, 'notifications', value=0)
 
     db.session.commit()
 
@@ -1095,6 +2635,7 @@ def mark_all_notifications_read():
         user_id=current_user.id,
         is_read=False
     ).update({'is_read': True})
+    queue_counter_update(current_user.id, 'notifications', value=0)
     db.session.commit()
 
     flash('Все уведомления отмечены как прочитанные')
@@ -1102,88 +2643,262 @@ def mark_all_notifications_read():
 
 
 # функция чатов
-def get_user_chats(user_id):
-    """список чатов"""
-    # поиск пользователей с кем уже есть чат
-    sent_messages = Message.query.filter_by(sender_id=user_id).all()
-    received_messages = Message.query.filter_by(receiver_id=user_id).all()
-
-    # id пользователей с чатов
-    chat_user_ids = set()
-
-    for msg in sent_messages:
-        chat_user_ids.add(msg.receiver_id)
-
-    for msg in received_messages:
-        chat_user_ids.add(msg.sender_id)
-
-    chats = []
-    for chat_user_id in chat_user_ids:
-        if chat_user_id != user_id:
-            other_user = db.session.get(User, chat_user_id)
-            if other_user:
-                # Получаем последнее сообщение в чате
-                last_message = Message.query.filter(
-                    db.or_(
-                        db.and_(Message.sender_id == user_id, Message.receiver_id == chat_user_id),
-                        db.and_(Message.sender_id == chat_user_id, Message.receiver_id == user_id)
-                    )
-                ).order_by(Message.created_at.desc()).first()
-
-                # непрочитанные сообщения
-                unread_count = Message.query.filter_by(
-                    sender_id=chat_user_id,
-                    receiver_id=user_id,
-                    is_read=False
-                ).count()
-
-                chats.append({
-                    'other_user': other_user,
-                    'last_message': last_message,
-                    'unread_count': unread_count
-                })
-
-    # сортировка по последнему сообщению
-    chats.sort(key=lambda x: x['last_message'].created_at if x['last_message'] else datetime.min, reverse=True)
-    return chats
-
-
-def get_chat_messages(user1_id, user2_id):
-    """получение сообщений между двумя пользователями"""
-    return Message.query.filter(
-        db.or_(
-            db.and_(Message.sender_id == user1_id, Message.receiver_id == user2_id),
-            db.and_(Message.sender_id == user2_id, Message.receiver_id == user1_id)
-        )
-    ).order_by(Message.created_at.asc()).all()
+CHATS_PER_PAGE = 30
+
+
+def record_message(message):
+    """обновляет сводку диалога в той же транзакции, что и новое сообщение"""
+    db.session.flush()  # нужен id сообщения
+
+    user1_id, user2_id = Conversation.pair(message.sender_id, message.receiver_id)
+    conversation = Conversation.query.filter_by(user1_id=user1_id, user2_id=user2_id).first()
+    if not conversation:
+        conversation = Conversation(user1_id=user1_id, user2_id=user2_id, user1_unread=0, user2_unread=0)
+        db.session.add(conversation)
+        db.session.flush()
+
+    conversation.last_message_id = message.id
+    conversation.last_message_at = message.created_at
+
+    # счетчик увеличиваем выражением, чтобы параллельные запросы не потеряли инкремент
+    if message.sender_id != message.receiver_id:
+        if message.receiver_id == user1_id:
+            conversation.user1_unread = Conversation.user1_unread + 1
+        else:
+            conversation.user2_unread = Conversation.user2_unread + 1
+    return conversation
+
+
+def get_user_chats(user_id, before=None, limit=CHATS_PER_PAGE):
+    """список чатов - один запрос по сводной таблице диалогов
+
+    before - id последнего сообщения, с которого продолжить список (для следующей страницы)
+    """
+    other_user_id = db.case(
+        (Conversation.user1_id == user_id, Conversation.user2_id),
+        else_=Conversation.user1_id
+    )
+    query = db.session.query(Conversation, User, Message).join(
+        User, User.id == other_user_id
+    ).outerjoin(
+        Message, Message.id == Conversation.last_message_id
+    ).filter(
+        db.or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id),
+        Conversation.user1_id != Conversation.user2_id
+    )
+
+    if before:
+        query = query.filter(Conversation.last_message_id < before)
+
+    rows = query.order_by(Conversation.last_message_id.desc()).limit(limit).all()
+
+    return [{
+        'conversation': conversation,
+        'other_user': other_user,
+        'last_message': last_message,
+        'unread_count': conversation.unread_for(user_id)
+    } for conversation, other_user, last_message in rows]
+
+
+def mark_chat_read(user_id, other_user_id):
+    """помечает диалог прочитанным до последнего сообщения (без commit)
+
+    пишется одна строка conversation, сколько бы сообщений ни было непрочитано;
+    собеседнику уходит событие read для отметок о прочтении
+    """
+    cleared = Notification.query.filter_by(
+        user_id=user_id,
+        related_id=other_user_id,
+        notification_type='message',
+        is_read=False
+    ).update({'is_read': True, 'unread_count': 0})
+    if cleared:
+        queue_counter_update(user_id, 'notifications', -cleared)
+
+    # UPDATE выше уже открыл транзакцию записи: сводка читается с пишущего соединения,
+    # и новое сообщение не вклинится между чтением счетчика и его сбросом
+    conversation = Conversation.between(user_id, other_user_id)
+    if conversation:
+        read = conversation.mark_read(user_id)
+        if read:
+            db.session.info.setdefault('realtime_events', []).append((other_user_id, 'read', {
+                'reader_id': user_id,
+                'last_read_id': conversation.last_read_for(user_id)
+            }))
+    return conversation
+
+
+def notify_new_message(sender, receiver_id, content):
+    """сводное уведомление о сообщениях от sender: счетчик непрочитанных и последний фрагмент
+
+    один INSERT ... ON CONFLICT DO UPDATE; прочитанное уведомление снова становится непрочитанным
+    со счетчиком 1 - только тогда растет счетчик в навигации и уходит событие для SSE
+    """
+    snippet = f'{sender.username}: {content[:50]}...'
+    insert = sqlite_insert(Notification).values(
+        user_id=receiver_id,
+        title='Новое сообщение',
+        message=snippet,
+        notification_type='message',
+        is_read=False,
+        related_id=sender.id,
+        created_at=datetime.now(timezone.utc),
+        unread_count=1
+    )
+    notification_id, unread_count = db.session.execute(insert.on_conflict_do_update(
+        index_elements=['user_id', 'related_id'],
+        index_where=db.text("notification_type = 'message'"),
+        set_={
+            'message': insert.excluded.message,
+            'created_at': insert.excluded.created_at,
+            'is_read': False,
+            'unread_count': db.case((Notification.is_read, 1), else_=Notification.unread_count + 1),
+        }
+    ).returning(Notification.id, Notification.unread_count)).one()
+
+    if unread_count == 1:
+        queue_counter_update(receiver_id, 'notifications', 1)
+        db.session.info.setdefault('realtime_events', []).append((receiver_id, 'notification', {
+            'id': notification_id,
+            'title': 'Новое сообщение',
+            'message': snippet,
+            'notification_type': 'message',
+            'related_id': sender.id
+        }))
+    return notification_id
+
+
+def fill_conversations(keep_read_marks=True):
+    """пересобирает сводки диалогов из таблицы message
+
+    отметки прочтения сохраняются (keep_read_marks); для новых сводок отметка ставится
+    перед первым непрочитанным входящим по старому полю message.is_read
+    """
+    read_marks = db.session.execute(text(
+        "SELECT user1_id, user2_id, user1_last_read_id, user2_last_read_id FROM conversation"
+    )).fetchall() if keep_read_marks else []
+    db.session.execute(text("DELETE FROM conversation"))
+
+    db.session.execute(text("""
+        INSERT INTO conversation (user1_id, user2_id, last_message_id, user1_unread, user2_unread,
+                                  user1_last_read_id, user2_last_read_id)
+        SELECT MIN(sender_id, receiver_id),
+               MAX(sender_id, receiver_id),
+               MAX(id),
+               0,
+               0,
+               COALESCE(MIN(CASE WHEN is_read = 0 AND sender_id != receiver_id
+                                 AND receiver_id = MIN(sender_id, receiver_id) THEN id END) - 1, MAX(id)),
+               COALESCE(MIN(CASE WHEN is_read = 0 AND sender_id != receiver_id
+                                 AND receiver_id = MAX(sender_id, receiver_id) THEN id END) - 1, MAX(id))
+        FROM message
+        GROUP BY MIN(sender_id, receiver_id), MAX(sender_id, receiver_id)
+    """))
+    if read_marks:
+        db.session.execute(text("""
+            UPDATE conversation
+            SET user1_last_read_id = :user1_last_read_id, user2_last_read_id = :user2_last_read_id
+            WHERE user1_id = :user1_id AND user2_id = :user2_id
+        """), [row._asdict() for row in read_marks])
+    # счетчики - число входящих после отметки, по индексу (sender_id, receiver_id, id)
+    db.session.execute(text("""
+        UPDATE conversation
+        SET last_message_at = (SELECT created_at FROM message WHERE message.id = conversation.last_message_id),
+            user1_unread = (SELECT COUNT(*) FROM message
+                            WHERE sender_id = conversation.user2_id AND receiver_id = conversation.user1_id
+                              AND id > conversation.user1_last_read_id AND sender_id != receiver_id),
+            user2_unread = (SELECT COUNT(*) FROM message
+                            WHERE sender_id = conversation.user1_id AND receiver_id = conversation.user2_id
+                              AND id > conversation.user2_last_read_id AND sender_id != receiver_id)
+    """))
+
+
+def rebuild_conversations():
+    """пересобирает сводки диалогов для существующей базы"""
+    with app.app_context():
+        Conversation.__table__.create(db.engine, checkfirst=True)
+        fill_conversations()
+        db.session.commit()
+        print(f"✅ Сводки диалогов пересобраны: {Conversation.query.count()}")
+
+
+CHAT_PAGE_SIZE = 50
+
+
+def chat_messages_query(user1_id, user2_id, before_id=None, since_id=None, limit=CHAT_PAGE_SIZE):
+    """запрос limit + 1 сообщений диалога от курсора (новые после since_id или старые до before_id)"""
+    forward = since_id is not None
+
+    def one_direction(sender_id, receiver_id):
+        # каждое направление читается по индексу (sender_id, receiver_id, id) не дальше limit + 1 строк
+        query = db.select(Message.id).where(Message.sender_id == sender_id, Message.receiver_id == receiver_id)
+        if before_id is not None:
+            query = query.where(Message.id < before_id)
+        if forward:
+            query = query.where(Message.id > since_id)
+        query = query.order_by(Message.id.asc() if forward else Message.id.desc()).limit(limit + 1)
+        return db.select(query.subquery().c.id)
+
+    page_ids = db.union_all(one_direction(user1_id, user2_id), one_direction(user2_id, user1_id)).subquery()
+    return Message.query.filter(Message.id.in_(db.select(page_ids.c.id))).order_by(
+        Message.id.asc() if forward else Message.id.desc()
+    ).limit(limit + 1)
+
+
+def get_chat_messages(user1_id, user2_id, before_id=None, since_id=None, limit=CHAT_PAGE_SIZE):
+    """страница сообщений между двумя пользователями в порядке отправки
+
+    before_id - более старые сообщения (подгрузка истории), since_id - новые после этого id;
+    без параметров - последние limit сообщений. Возвращает (сообщения, есть_ли_еще)
+    """
+    forward = since_id is not None
+    messages = chat_messages_query(user1_id, user2_id, before_id, since_id, limit).all()
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not forward:
+        messages.reverse()
+    return messages, has_more
 
 
 # система чатов
 @app.route('/chats')
 @login_required
+@query_budget(15)  # пометка прочтения пишет счетчик и событие для потока в той же транзакции
 def chat_list():
-    chats = get_user_chats(current_user.id)
     selected_user_id = request.args.get('user_id')
+    before = request.args.get('before', type=int)
     selected_user = None
     messages = []
+    has_older_messages = False
+    read_up_to = 0
+    # курсор потока событий: все, что произойдет после отрисовки страницы, дойдет через /api/events
+    realtime_since = realtime_cursor(current_user.id)
 
     if selected_user_id:
         selected_user = db.session.get(User, int(selected_user_id))
         if selected_user:
-            messages = get_chat_messages(current_user.id, selected_user.id)
-
-            # Помечаем сообщения как прочитанные
-            Message.query.filter_by(
-                sender_id=selected_user.id,
-                receiver_id=current_user.id,
-                is_read=False
-            ).update({'is_read': True})
+            # Помечаем сообщения как прочитанные до загрузки истории:
+            # commit сбрасывает загруженные объекты, и шаблон перечитывал бы каждое сообщение отдельно
+            conversation = mark_chat_read(current_user.id, selected_user.id)
+            # отметка собеседника для галочек прочтения - до commit, пока сводка загружена
+            read_up_to = conversation.last_read_for(selected_user.id) if conversation else 0
             db.session.commit()
 
+            messages, has_older_messages = get_chat_messages(current_user.id, selected_user.id)
+
+    # список чатов строим после пометки, чтобы счетчик открытого диалога был актуален
+    chats = get_user_chats(current_user.id, before=before)
+    next_before = chats[-1]['conversation'].last_message_id if len(chats) == CHATS_PER_PAGE else None
+
     return render_template('chat_list.html',
                            chats=chats,
+                           next_before=next_before,
                            selected_user=selected_user,
                            messages=messages,
+                           has_older_messages=has_older_messages,
+                           read_up_to=read_up_to,
+                           realtime_since=realtime_since,
                            User=User,
                            Message=Message,
                            time=time)
@@ -1208,17 +2923,12 @@ def send_message():
         content=content
     )
     db.session.add(message)
+    record_message(message)
 
-    # уведомление для получателя
-    notification = Notification(
-        user_id=receiver_id,
-        title='Новое сообщение',
-        message=f'{current_user.username}: {content[:50]}...',
-        notification_type='message',
-        related_id=current_user.id
-    )
-    db.session.add(notification)
+    # уведомление для получателя: одно на диалог, обновляется на месте
+    notify_new_message(current_user, receiver_id, content)
 
+    receiver_username = receiver.username
     db.session.commit()
 
     return jsonify({
@@ -1226,48 +2936,732 @@ def send_message():
         'message_id': message.id,
         'created_at': message.created_at.strftime('%H:%M'),
         'sender_username': current_user.username,
+        'receiver_username': receiver_username,
         'sender_avatar': current_user.username[0]
     })
 
 
-@app.route('/api/check_new_messages')
+# события в реальном времени (Server-Sent Events)
+class EventBus:
+    """пробуждение открытых потоков событий своего процесса
+
+    сами события лежат в таблице realtime_event; commit своего процесса будит потоки сразу,
+    commit других воркеров замечает RealtimeWatcher. Поток без пробуждений в базу не ходит
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscriber = queue.Queue(maxsize=1)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self.lock:
+            user_subscribers = self.subscribers.get(user_id)
+            if user_subscribers:
+                user_subscribers.discard(subscriber)
+                if not user_subscribers:
+                    del self.subscribers[user_id]
+
+    def has_subscribers(self):
+        with self.lock:
+            return bool(self.subscribers)
+
+    def subscribed_users(self):
+        with self.lock:
+            return set(self.subscribers)
+
+    def publish(self, user_id):
+        with self.lock:
+            user_subscribers = list(self.subscribers.get(user_id, ()))
+        for subscriber in user_subscribers:
+            try:
+                subscriber.put_nowait(True)
+            except queue.Full:
+                pass  # поток еще не забрал прошлое пробуждение - прочитает все события разом
+
+
+event_bus = EventBus()
+REALTIME_WATCH_SECONDS = 1  # как часто наблюдатель процесса проверяет PRAGMA data_version
+SSE_KEEPALIVE_SECONDS = 15
+SSE_STREAM_SECONDS = 600  # поток закрывается, браузер переподключается с Last-Event-ID
+SSE_BATCH_SIZE = 100
+REALTIME_EVENT_TTL = timedelta(hours=1)
+REALTIME_EVENT_PRUNE_SECONDS = 300  # как часто воркер outbox удаляет старые события
+
+
+class RealtimeWatcher:
+    """один поток на процесс: будит потоки событий после commit других воркеров
+
+    пока есть подписчики, раз в REALTIME_WATCH_SECONDS читает PRAGMA data_version своего подключения -
+    счетчик меняется только после commit другого подключения и не читает таблиц. Лишь тогда
+    один запрос по первичному ключу находит новые строки realtime_event и будит их получателей
+    """
+
+    def __init__(self, interval=REALTIME_WATCH_SECONDS):
+        self.interval = interval
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.wakeup.set()
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            with app.app_context():
+                url = db.engine.url
+            if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+                return  # база одного процесса - хватает пробуждений после commit
+            self.thread = threading.Thread(target=self.run, name='realtime-watcher', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                with app.app_context():
+                    self.watch()
+            except Exception as e:
+                print(f"❌ Ошибка наблюдателя realtime_event: {e}")
+                time.sleep(self.interval)
+
+    def watch(self):
+        """следит за базой, пока открыт хотя бы один поток событий процесса"""
+        engine = get_read_engine(db.engine) or db.engine
+        with engine.connect() as connection:
+            data_version = connection.exec_driver_sql('PRAGMA data_version').scalar()
+            last_id = connection.execute(db.select(db.func.max(RealtimeEvent.id))).scalar() or 0
+            connection.rollback()
+            # события до этой точки потоки могли не застать при подключении - перечитают один раз
+            for user_id in event_bus.subscribed_users():
+                event_bus.publish(user_id)
+            while event_bus.has_subscribers():
+                time.sleep(self.interval)
+                version = connection.exec_driver_sql('PRAGMA data_version').scalar()
+                if version == data_version:
+                    continue
+                data_version = version
+                rows = connection.execute(db.select(RealtimeEvent.id, RealtimeEvent.user_id).where(
+                    RealtimeEvent.id > last_id).order_by(RealtimeEvent.id)).all()
+                connection.rollback()
+                if rows:
+                    last_id = rows[-1].id
+                    for user_id in {row.user_id for row in rows} & event_bus.subscribed_users():
+                        event_bus.publish(user_id)
+
+
+realtime_watcher = RealtimeWatcher()
+
+
+def message_event(session, message):
+    sender = session.get(User, message.sender_id)
+    receiver = session.get(User, message.receiver_id)
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'receiver_id': message.receiver_id,
+        'sender_username': sender.username if sender else '',
+        'receiver_username': receiver.username if receiver else '',
+        'content': message.content,
+        'created_at': message.created_at.strftime('%H:%M') if message.created_at else ''
+    }
+
+
+def notification_event(notification):
+    return {
+        'id': notification.id,
+        'title': notification.title,
+        'message': notification.message,
+        'notification_type': notification.notification_type,
+        'related_id': notification.related_id
+    }
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def collect_realtime_events(session, flush_context):
+    """запоминает новые сообщения и уведомления; отправляются только после commit"""
+    events = session.info.setdefault('realtime_events', [])
+    for obj in session.new:
+        if isinstance(obj, Message):
+            data = message_event(session, obj)
+            events.append((obj.receiver_id, 'message', data))
+            if obj.sender_id != obj.receiver_id:
+                events.append((obj.sender_id, 'message', data))  # другие вкладки отправителя
+        elif isinstance(obj, Notification):
+            events.append((obj.user_id, 'notification', notification_event(obj)))
+
+
+@db.event.listens_for(db.session, 'before_commit')
+def store_realtime_events(session):
+    """события транзакции - строками realtime_event в той же транзакции"""
+    session.flush()  # события новых объектов собирает after_flush
+    events = session.info.get('realtime_events')
+    if events:
+        created_at = datetime.now(timezone.utc)
+        session.execute(db.insert(RealtimeEvent), [{
+            'user_id': user_id,
+            'event': event,
+            'data': json.dumps(data, ensure_ascii=False),
+            'created_at': created_at
+        } for user_id, event, data in events])
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def publish_realtime_events(session):
+    for user_id in {user_id for user_id, _, _ in session.info.pop('realtime_events', [])}:
+        event_bus.publish(user_id)
+
+
+def realtime_cursor(user_id):
+    """id последнего события пользователя - с него поток начнет отдачу"""
+    return db.session.query(db.func.max(RealtimeEvent.id)).filter(RealtimeEvent.user_id == user_id).scalar() or 0
+
+
+def realtime_events_after(user_id, last_id, limit=SSE_BATCH_SIZE):
+    return db.session.query(RealtimeEvent.id, RealtimeEvent.event, RealtimeEvent.data).filter(
+        RealtimeEvent.user_id == user_id, RealtimeEvent.id > last_id
+    ).order_by(RealtimeEvent.id).limit(limit)
+
+
+def prune_realtime_events():
+    """удаляет события старше REALTIME_EVENT_TTL - клиенты, отключенные дольше, перезагружают страницу"""
+    deleted = db.session.execute(db.delete(RealtimeEvent).where(
+        RealtimeEvent.created_at < datetime.now(timezone.utc) - REALTIME_EVENT_TTL
+    )).rowcount
+    db.session.commit()
+    return deleted
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_realtime_events(session):
+    session.info.pop('realtime_events', None)
+
+
+# массовая рассылка уведомлений
+def notify_users(user_ids, title, message, notification_type=None, related_id=None):
+    """одно уведомление каждому получателю одним INSERT на всю пачку
+
+    строки пишутся мимо ORM-сессии, поэтому счетчики и события для SSE ставятся
+    в очередь здесь же; применяются они после commit, как и для обычных объектов
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return []
+
+    created_at = datetime.now(timezone.utc)
+    rows = [{
+        'user_id': user_id,
+        'title': title,
+        'message': message,
+        'notification_type': notification_type,
+        'is_read': False,
+        'related_id': related_id,
+        'created_at': created_at
+    } for user_id in user_ids]
+    result = db.session.execute(
+        db.insert(Notification).returning(Notification.id, sort_by_parameter_order=True), rows
+    )
+    ids = result.scalars().all()
+
+    events = db.session.info.setdefault('realtime_events', [])
+    for notification_id, user_id in zip(ids, user_ids):
+        queue_counter_update(user_id, 'notifications', 1)
+        events.append((user_id, 'notification', {
+            'id': notification_id,
+            'title': title,
+            'message': message,
+            'notification_type': notification_type,
+            'related_id': related_id
+        }))
+    return ids
+
+
+def notify_moderators(title, message, notification_type='warning', related_id=None):
+    moderator_ids = db.session.scalars(db.select(User.id).filter_by(is_moderator=True)).all()
+    return notify_users(moderator_ids, title, message, notification_type, related_id)
+
+
+def benchmark_notifications(recipients=500, rounds=3):
+    """сравнение рассылки по одному ORM-объекту и notify_users; все изменения откатываются"""
+    with app.app_context():
+        user_id = db.session.scalar(db.select(User.id).limit(1))
+        if user_id is None:
+            print("❌ В базе нет пользователей")
+            return
+        user_ids = [user_id] * recipients
+
+        def orm_loop():
+            for recipient_id in user_ids:
+                db.session.add(Notification(user_id=recipient_id, title='Тест', message='Тест',
+                                            notification_type='system'))
+            db.session.flush()
+
+        def bulk():
+            # повторы получателей схлопываются, поэтому id делаем разными
+            notify_users(range(-recipients, 0), 'Тест', 'Тест', 'system')
+
+        results = {}
+        for name, fill in (('ORM по одному', orm_loop), ('notify_users', bulk)):
+            best = None
+            for _ in range(rounds):
+                started = time.perf_counter()
+                fill()
+                elapsed = time.perf_counter() - started
+                db.session.rollback()
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = best
+            print(f"📊 {name}: {best * 1000:.1f} мс на {recipients} получателей, "
+                  f"{best / recipients * 1e6:.1f} мкс на получателя")
+
+        speedup = results['ORM по одному'] / results['notify_users']
+        print(f"✅ notify_users быстрее в {speedup:.1f} раз")
+        return results
+
+
+# outbox: побочные действия выполняются фоновыми потоками после commit
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 2))
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_POLL_SECONDS = 5
+OUTBOX_LEASE_SECONDS = 60  # событие, взятое упавшим воркером, снова доступно через это время
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 2  # секунды, удваиваются с каждой попыткой
+
+OUTBOX_HANDLERS = {}
+
+
+def outbox_handler(event_type):
+    def decorator(handler):
+        OUTBOX_HANDLERS[event_type] = handler
+        return handler
+    return decorator
+
+
+def enqueue_outbox(event_type, **payload):
+    """добавляет событие в текущую транзакцию; воркер получит его только после commit"""
+    db.session.add(OutboxEvent(event_type=event_type, payload=json.dumps(payload, ensure_ascii=False)))
+    db.session.info['outbox_enqueued'] = True
+
+
+def enqueue_notification(user_ids, title, message, notification_type=None, related_id=None):
+    enqueue_outbox('notify_users', user_ids=list(user_ids), title=title, message=message,
+                   notification_type=notification_type, related_id=related_id)
+
+
+def enqueue_moderator_notification(title, message, notification_type='warning', related_id=None):
+    enqueue_outbox('notify_moderators', title=title, message=message,
+                   notification_type=notification_type, related_id=related_id)
+
+
+@outbox_handler('notify_users')
+def handle_notify_users(user_ids, title, message, notification_type=None, related_id=None):
+    # получатель мог быть удален, пока событие ждало в очереди
+    existing_ids = set(db.session.scalars(db.select(User.id).where(User.id.in_(user_ids))))
+    notify_users([user_id for user_id in user_ids if user_id in existing_ids], title, message,
+                 notification_type, related_id)
+
+
+@outbox_handler('notify_moderators')
+def handle_notify_moderators(title, message, notification_type='warning', related_id=None):
+    notify_moderators(title, message, notification_type, related_id)
+
+
+@outbox_handler('send_message')
+def handle_send_message(sender_id, receiver_id, content):
+    message = Message(sender_id=sender_id, receiver_id=receiver_id, content=content)
+    db.session.add(message)
+    record_message(message)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def wake_outbox_worker(session):
+    if session.info.pop('outbox_enqueued', False):
+        outbox_worker.wake()
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_outbox_wakeup(session):
+    session.info.pop('outbox_enqueued', None)
+
+
+def claim_outbox_events(limit=OUTBOX_BATCH_SIZE):
+    """атомарно забирает пачку готовых событий: один UPDATE ... RETURNING
+
+    пустая очередь стоит одного чтения из пула чтения - блокировка записи не берется;
+    событие, чья аренда истекла на последней попытке (воркер упал), получает статус failed
+    """
+    now = datetime.now(timezone.utc)
+    is_ready = db.and_(OutboxEvent.status.in_(['pending', 'processing']), OutboxEvent.available_at <= now)
+    if db.session.scalar(db.select(OutboxEvent.id).where(is_ready).limit(1)) is None:
+        return []
+
+    db.session.execute(db.update(OutboxEvent).where(
+        is_ready, OutboxEvent.status == 'processing', OutboxEvent.attempts >= OUTBOX_MAX_ATTEMPTS
+    ).values(status='failed', last_error='Аренда истекла: воркер не завершил обработку'))
+    ready = db.select(OutboxEvent.id).where(
+        is_ready, OutboxEvent.attempts < OUTBOX_MAX_ATTEMPTS
+    ).order_by(OutboxEvent.id).limit(limit)
+    claimed = db.session.execute(
+        db.update(OutboxEvent).where(OutboxEvent.id.in_(ready)).values(
+            status='processing',
+            attempts=OutboxEvent.attempts + 1,
+            available_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        ).returning(OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.payload, OutboxEvent.attempts)
+    ).all()
+    db.session.commit()
+    return sorted(claimed)
+
+
+def process_outbox_event(event_id, event_type, payload, attempts):
+    """обработчик и удаление события - одна транзакция; при ошибке событие откладывается"""
+    try:
+        OUTBOX_HANDLERS[event_type](**json.loads(payload))
+        db.session.execute(db.delete(OutboxEvent).where(OutboxEvent.id == event_id))
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        failed = attempts >= OUTBOX_MAX_ATTEMPTS
+        db.session.execute(db.update(OutboxEvent).where(OutboxEvent.id == event_id).values(
+            status='failed' if failed else 'pending',
+            last_error=f'{type(e).__name__}: {e}',
+            available_at=datetime.now(timezone.utc) + timedelta(seconds=OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+        ))
+        db.session.commit()
+        print(f"❌ Событие outbox {event_id} ({event_type}), попытка {attempts}: {e}")
+        return False
+
+
+def process_outbox(limit=OUTBOX_BATCH_SIZE):
+    """обрабатывает одну пачку событий в текущем контексте приложения; возвращает число взятых событий"""
+    events = claim_outbox_events(limit)
+    for event in events:
+        process_outbox_event(*event)
+    return len(events)
+
+
+def drain_outbox():
+    """обработать все готовые события без фонового воркера"""
+    with app.app_context():
+        processed = 0
+        while True:
+            count = process_outbox()
+            if not count:
+                break
+            processed += count
+        print(f"✅ Обработано событий outbox: {processed}")
+        return processed
+
+
+def outbox_stats():
+    """глубина очереди: число событий по статусам и возраст самого старого ожидающего"""
+    counts = dict(db.session.query(OutboxEvent.status, db.func.count(OutboxEvent.id))
+                  .group_by(OutboxEvent.status).all())
+    oldest = db.session.scalar(db.select(db.func.min(OutboxEvent.created_at)).where(OutboxEvent.status != 'failed'))
+    if oldest and oldest.tzinfo is None:
+        oldest = oldest.replace(tzinfo=timezone.utc)
+    return {
+        'pending': counts.get('pending', 0),
+        'processing': counts.get('processing', 0),
+        'failed': counts.get('failed', 0),
+        'oldest_pending_seconds': round((datetime.now(timezone.utc) - oldest).total_seconds(), 1) if oldest else 0,
+        'workers': outbox_worker.alive_threads(),
+    }
+
+
+class OutboxWorker:
+    """пул потоков, разбирающих outbox; будится после commit с новыми событиями и по таймеру"""
+
+    def __init__(self, threads=OUTBOX_WORKERS):
+        self.threads_count = threads
+        self.threads = []
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.threads or self.threads_count <= 0:
+                return
+            for number in range(self.threads_count):
+                thread = threading.Thread(target=self.run, name=f'outbox-worker-{number}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def wake(self):
+        self.wakeup.set()
+
+    def alive_threads(self):
+        return sum(thread.is_alive() for thread in self.threads)
+
+    def run(self):
+        pruned_at = 0
+        while True:
+            self.wakeup.wait(OUTBOX_POLL_SECONDS)
+            self.wakeup.clear()
+            try:
+                with app.app_context():
+                    while process_outbox():
+                        pass
+                    if time.monotonic() - pruned_at > REALTIME_EVENT_PRUNE_SECONDS:
+                        pruned_at = time.monotonic()
+                        prune_realtime_events()
+            except Exception as e:
+                print(f"❌ Ошибка воркера outbox: {e}")
+
+
+outbox_worker = OutboxWorker()
+
+
+@app.before_request
+def start_outbox_worker():
+    # запускаем в процессе, который обслуживает запросы (не в процессе перезагрузчика debug-режима)
+    outbox_worker.start()
+
+
+@app.route('/admin/outbox')
 @login_required
-def check_new_messages():
-    """новое сообщение для пользователя"""
-    last_check = request.args.get('last_check', type=float)
-
-    if last_check:
-        # новые сообщения после проверки
-        new_messages = Message.query.filter(
-            Message.receiver_id == current_user.id,
-            Message.created_at > datetime.fromtimestamp(last_check, timezone.utc)
-        ).order_by(Message.created_at.desc()).all()
-
-        # новые уведомления
-        new_notifications = Notification.query.filter(
-            Notification.user_id == current_user.id,
-            Notification.created_at > datetime.fromtimestamp(last_check, timezone.utc)
-        ).order_by(Notification.created_at.desc()).all()
-
-        return jsonify({
-            'has_new_messages': len(new_messages) > 0,
-            'has_new_notifications': len(new_notifications) > 0,
-            'new_messages_count': len(new_messages),
-            'new_notifications_count': len(new_notifications),
-            'current_time': time.time()
-        })
+def admin_outbox_stats():
+    if not current_user.is_moderator:
+        return jsonify({'status': 'error', 'message': 'Доступ запрещен'}), 403
+    return jsonify(outbox_stats())
+
+
+# фоновое каскадное удаление: набор зависимых строк задается условиями с подзапросами,
+# каждая транзакция удаляет не больше DELETION_CHUNK_SIZE строк и ставит в outbox продолжение
+DELETION_CHUNK_SIZE = 1000
+PROJECT_NOTIFICATION_TYPES = ['project_response', 'project_accepted', 'project_completed', 'project_cancelled', 'review']
+
+
+def project_deletion_steps(project_ids):
+    """шаги удаления проектов; project_ids - список или подзапрос"""
+    return [
+        (ProjectResponse.__table__, ProjectResponse.project_id.in_(project_ids)),
+        (Review.__table__, Review.project_id.in_(project_ids)),
+        (Notification.__table__, db.and_(Notification.related_id.in_(project_ids),
+                                         Notification.notification_type.in_(PROJECT_NOTIFICATION_TYPES))),
+        (project_skill, project_skill.c.project_id.in_(project_ids)),
+        (Project.__table__, Project.id.in_(project_ids)),
+    ]
+
+
+def user_deletion_steps(user_id):
+    """шаги удаления пользователя: сначала зависимые строки, в конце сам пользователь"""
+    return [
+        (Notification.__table__, Notification.user_id == user_id),
+        (Notification.__table__, db.and_(Notification.related_id == user_id, Notification.notification_type == 'message')),
+        (Message.__table__, Message.sender_id == user_id),
+        (Message.__table__, Message.receiver_id == user_id),
+        (Conversation.__table__, Conversation.user1_id == user_id),
+        (Conversation.__table__, Conversation.user2_id == user_id),
+        (ProjectResponse.__table__, ProjectResponse.freelancer_id == user_id),
+        (Review.__table__, Review.reviewer_id == user_id),
+        (Review.__table__, Review.freelancer_id == user_id),
+        *project_deletion_steps(db.select(Project.id).where(Project.client_id == user_id)),
+        (TicketMessage.__table__, TicketMessage.ticket_id.in_(
+            db.select(SupportTicket.id).where(SupportTicket.user_id == user_id))),
+        (TicketMessage.__table__, TicketMessage.user_id == user_id),
+        (SupportTicket.__table__, SupportTicket.user_id == user_id),
+        (profile_skill, profile_skill.c.profile_id.in_(db.select(Profile.id).where(Profile.user_id == user_id))),
+        (Profile.__table__, Profile.user_id == user_id),
+        (User.__table__, User.id == user_id),
+    ]
+
+
+def deletion_steps(job):
+    if job.kind == 'user':
+        return user_deletion_steps(job.target_id)
+    return project_deletion_steps([job.target_id])
+
+
+def delete_chunk(table, condition, limit):
+    """DELETE ... WHERE rowid IN (SELECT rowid ... LIMIT n); возвращает число удаленных строк
+
+    удаленные непрочитанные уведомления уменьшают счетчики получателей
+    """
+    rowid = db.literal_column('rowid')
+    chunk = db.select(rowid).select_from(table).where(condition).limit(limit)
+    statement = db.delete(table).where(rowid.in_(chunk))
+    if table is Notification.__table__:
+        rows = db.session.execute(statement.returning(table.c.user_id, table.c.is_read)).all()
+        for user_id, is_read in rows:
+            if not is_read:
+                queue_counter_update(user_id, 'notifications', -1)
+        return len(rows)
+    return db.session.execute(statement).rowcount
+
+
+def start_deletion_job(kind, target_id, target_name, rated_users=()):
+    """ставит удаление в очередь; вызывать до изменений в транзакции - подсчет строк идет через пул чтения"""
+    job = DeletionJob(kind=kind, target_id=target_id, target_name=target_name,
+                      rated_users=json.dumps(sorted(rated_users)))
+    job.total_rows = sum(db.session.scalar(db.select(db.func.count()).select_from(table).where(condition))
+                         for table, condition in deletion_steps(job))
+    db.session.add(job)
+    db.session.flush()
+    enqueue_outbox('delete_cascade', job_id=job.id)
+    return job
+
+
+def running_deletion(kind, target_id):
+    return DeletionJob.query.filter_by(kind=kind, target_id=target_id, status='running').first()
+
+
+@outbox_handler('delete_cascade')
+def handle_delete_cascade(job_id):
+    """одна порция удаления; если строки остались - продолжение следующей транзакцией"""
+    job = db.session.get(DeletionJob, job_id)
+    if job is None or job.status != 'running':
+        return
+    steps = deletion_steps(job)
+    budget = DELETION_CHUNK_SIZE
+    while budget and job.step < len(steps):
+        table, condition = steps[job.step]
+        deleted = delete_chunk(table, condition, budget)
+        job.deleted_rows += deleted
+        if deleted < budget:
+            job.step += 1
+        budget -= deleted
+
+    if job.step < len(steps):
+        enqueue_outbox('delete_cascade', job_id=job.id)
+        return
+    rated_users = set(json.loads(job.rated_users))
+    if job.kind == 'user':
+        rated_users.discard(job.target_id)
+    if rated_users:
+        update_rating_aggregates(rated_users)
+    job.status = 'done'
+    job.finished_at = datetime.now(timezone.utc)
+
+
+def deletion_progress(limit=10):
+    """последние задания удаления с процентом выполнения"""
+    jobs = DeletionJob.query.order_by(DeletionJob.created_at.desc()).limit(limit).all()
+    return [{
+        'id': job.id,
+        'kind': job.kind,
+        'target_id': job.target_id,
+        'target_name': job.target_name,
+        'status': job.status,
+        'deleted_rows': job.deleted_rows,
+        'total_rows': job.total_rows,
+        'percent': 100 if job.status == 'done' else min(99, round(job.deleted_rows * 100 / (job.total_rows or 1))),
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    } for job in jobs]
+
+
+@app.route('/admin/deletions')
+@login_required
+def admin_deletion_progress():
+    if not current_user.is_moderator:
+        return jsonify({'status': 'error', 'message': 'Доступ запрещен'}), 403
+    return jsonify(deletion_progress())
 
-    return jsonify({'current_time': time.time()})
+
+@app.route('/api/events')
+@login_required
+def event_stream():
+    """поток событий пользователя: новые сообщения и уведомления без опроса страницы
+
+    события читаются из realtime_event после курсора: Last-Event-ID при переподключении,
+    ?since= со страницы или последнее событие на момент подключения. После подключения
+    база читается только по пробуждению из event_bus; поток живет не дольше SSE_STREAM_SECONDS
+    """
+    user_id = current_user.id
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('since', type=int)
+    if last_id is None:
+        last_id = realtime_cursor(user_id)
+    # соединение с базой не держим, пока поток открыт - каждая проверка берет его из пула заново
+    db.session.close()
+
+    def generate():
+        nonlocal last_id
+        subscriber = event_bus.subscribe(user_id)
+        realtime_watcher.start()
+        closes_at = time.monotonic() + SSE_STREAM_SECONDS
+        pending = True  # пропущенное до подписки читается один раз при подключении
+        try:
+            yield 'retry: 2000\n\n'
+            while time.monotonic() < closes_at:
+                if pending:
+                    with app.app_context():
+                        rows = realtime_events_after(user_id, last_id).all()
+                    for event_id, event, data in rows:
+                        last_id = event_id
+                        yield f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+                    if len(rows) == SSE_BATCH_SIZE:
+                        continue
+                try:
+                    pending = subscriber.get(timeout=min(SSE_KEEPALIVE_SECONDS, max(0, closes_at - time.monotonic())))
+                except queue.Empty:
+                    pending = False
+                    yield ': keepalive\n\n'
+        finally:
+            event_bus.unsubscribe(user_id, subscriber)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/chats/<int:user_id>/messages')
+@login_required
+def chat_messages_api(user_id):
+    """история диалога порциями: ?before=<id> - более старые, ?since=<id> - новые"""
+    other_user = db.session.get(User, user_id)
+    if not other_user:
+        return jsonify({'status': 'error', 'message': 'Пользователь не найден'}), 404
+
+    limit = max(1, min(request.args.get('limit', CHAT_PAGE_SIZE, type=int), MAX_PER_PAGE))
+    messages, has_more = get_chat_messages(
+        current_user.id, user_id,
+        before_id=request.args.get('before', type=int),
+        since_id=request.args.get('since', type=int),
+        limit=limit
+    )
+    conversation = Conversation.between(current_user.id, user_id)
+
+    return jsonify({
+        'status': 'success',
+        'messages': [message_event(db.session, message) for message in messages],
+        'has_more': has_more,
+        'read_up_to': conversation.last_read_for(user_id) if conversation else 0
+    })
+
+
+@app.route('/api/chats/<int:user_id>/read', methods=['POST'])
+@login_required
+def mark_chat_read_api(user_id):
+    """пометить диалог прочитанным (сообщение пришло в открытый чат)"""
+    mark_chat_read(current_user.id, user_id)
+    db.session.commit()
+    return jsonify({'status': 'success'})
 
 # система поддержки
 @app.route('/support')
 @login_required
+@query_budget(7)
 def support():
-    user_tickets = SupportTicket.query.filter_by(
-        user_id=current_user.id
-    ).order_by(SupportTicket.created_at.desc()).all()
+    user_tickets, next_cursor = keyset_paginate(
+        SupportTicket.query.filter_by(user_id=current_user.id),
+        SupportTicket.created_at, SupportTicket.id
+    )
 
-    return render_template('support.html', tickets=user_tickets)
+    # счетчики по статусам по всем обращениям пользователя
+    ticket_counts = dict(db.session.query(SupportTicket.status, db.func.count()).filter(
+        SupportTicket.user_id == current_user.id
+    ).group_by(SupportTicket.status).all())
+    ticket_counts['total'] = sum(ticket_counts.values())
+
+    return render_template('support.html', tickets=user_tickets, ticket_counts=ticket_counts,
+                           next_cursor=next_cursor)
 
 
 @app.route('/support/create', methods=['GET', 'POST'])
@@ -1291,7 +3685,7 @@ def create_support_ticket():
             priority=priority
         )
         db.session.add(ticket)
-        db.session.commit()
+        db.session.flush()  # нужен id обращения
 
         # новое сообщение в тикете
         ticket_message = TicketMessage(
@@ -1303,25 +3697,19 @@ def create_support_ticket():
         db.session.add(ticket_message)
 
         # уведомление для админа
-        moderators = User.query.filter_by(is_moderator=True).all()
-        for moderator in moderators:
-            moderator_notification = Notification(
-                user_id=moderator.id,
-                title='Новое обращение в поддержку',
-                message=f'Пользователь {current_user.username} создал обращение: {subject}',
-                notification_type='warning',
-                related_id=ticket.id
-            )
-            db.session.add(moderator_notification)
+        enqueue_moderator_notification(
+            title='Новое обращение в поддержку',
+            message=f'Пользователь {current_user.username} создал обращение: {subject}',
+            related_id=ticket.id
+        )
 
         # уведомление для пользователя
-        user_notification = Notification(
-            user_id=current_user.id,
+        enqueue_notification(
+            [current_user.id],
             title='Обращение в поддержку создано',
             message=f'Ваше обращение "{subject}" принято в обработку.',
             notification_type='system'
         )
-        db.session.add(user_notification)
 
         db.session.commit()
 
@@ -1333,6 +3721,7 @@ def create_support_ticket():
 
 @app.route('/support/ticket/<int:ticket_id>')
 @login_required
+@query_budget(8)
 def support_ticket(ticket_id):
     ticket = SupportTicket.query.get_or_404(ticket_id)
 
@@ -1378,26 +3767,20 @@ def reply_support_ticket(ticket_id):
     # уведомление для другой стороны
     if current_user.is_moderator:
         # уведомление для пользователя
-        notification = Notification(
-            user_id=ticket.user_id,
+        enqueue_notification(
+            [ticket.user_id],
             title='Новый ответ от поддержки',
             message=f'По вашему обращению "{ticket.subject}" получен ответ.',
             notification_type='system',
             related_id=ticket.id
         )
-        db.session.add(notification)
     else:
         # уведомление для модераторов
-        moderators = User.query.filter_by(is_moderator=True).all()
-        for moderator in moderators:
-            notification = Notification(
-                user_id=moderator.id,
-                title='Новый ответ в обращении',
-                message=f'Пользователь {current_user.username} ответил в обращении: {ticket.subject}',
-                notification_type='warning',
-                related_id=ticket.id
-            )
-            db.session.add(notification)
+        enqueue_moderator_notification(
+            title='Новый ответ в обращении',
+            message=f'Пользователь {current_user.username} ответил в обращении: {ticket.subject}',
+            related_id=ticket.id
+        )
 
     db.session.commit()
 
@@ -1424,38 +3807,119 @@ def close_support_ticket(ticket_id):
 
 
 # панель модера
+DASHBOARD_STATS_TTL = 30
+
+
+class CounterCache:
+    """значения с TTL в памяти процесса
+
+    подходит только для данных, которым допустимо отставать на ttl секунд
+    и в другом процессе (снимок статистики панели модератора)
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id, name, loader):
+        key = (user_id, name)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.values.get(key)
+            if entry and entry[1] > now:
+                return entry[0]
+        value = loader()
+        with self.lock:
+            self.values[key] = (value, now + self.ttl)
+        return value
+
+    def invalidate(self, user_id=None):
+        with self.lock:
+            if user_id is None:
+                self.values.clear()
+            else:
+                for key in [key for key in self.values if key[0] == user_id]:
+                    del self.values[key]
+
+
+dashboard_stats_cache = CounterCache(ttl=DASHBOARD_STATS_TTL)
+
+
+def grouped_counts(column):
+    """{значение: количество строк} одним GROUP BY"""
+    return dict(db.session.query(column, db.func.count()).group_by(column).all())
+
+
+def compute_dashboard_stats():
+    """статистика панели модератора: по одному GROUP BY на таблицу"""
+    users = grouped_counts(User.is_client)
+    projects = grouped_counts(Project.status)
+    tickets = grouped_counts(SupportTicket.status)
+    return {
+        'total_users': sum(users.values()),
+        'total_clients': users.get(True, 0),
+        'total_projects': sum(projects.values()),
+        'open_projects': projects.get('open', 0),
+        'total_tickets': sum(tickets.values()),
+        'open_tickets': tickets.get('open', 0) + tickets.get('in_progress', 0),
+        'closed_tickets': tickets.get('closed', 0),
+        'updated_at': datetime.now(timezone.utc)
+    }
+
+
+def get_dashboard_stats():
+    """снимок статистики, общий для всех модераторов; пересчитывается не чаще раза в DASHBOARD_STATS_TTL секунд"""
+    return dashboard_stats_cache.get(None, 'dashboard', compute_dashboard_stats)
+
+
 @app.route('/admin')
 @login_required
+@query_budget(12)
 def admin_dashboard():
-    print(
-        f"🔍 Проверка прав пользователя {current_user.username}: is_moderator = {current_user.is_moderator}")  # Для отладки
-
     if not current_user.is_moderator:
         flash('Доступ запрещен. Только модераторы могут просматривать эту страницу.')
         return redirect(url_for('index'))
 
-    # Получаем ВСЕ обращения (не только открытые)
-    all_tickets = SupportTicket.query.order_by(desc(SupportTicket.created_at)).all()
-    open_tickets = [t for t in all_tickets if t.status in ['open', 'in_progress']]
-    closed_tickets = [t for t in all_tickets if t.status == 'closed']
-
-    stats = {
-        'total_users': User.query.count(),
-        'total_projects': Project.query.count(),
-        'open_projects': Project.query.filter_by(status='open').count(),
-        'total_tickets': len(all_tickets),
-        'open_tickets': len(open_tickets),
-        'closed_tickets': len(closed_tickets)
-    }
+    # Последние обращения - 10 строк вместе с авторами
+    recent_tickets = SupportTicket.query.options(db.joinedload(SupportTicket.user)).order_by(
+        SupportTicket.created_at.desc(), SupportTicket.id.desc()
+    ).limit(10).all()
+
+    stats = dict(get_dashboard_stats(), outbox=outbox_stats(),
+                 deletions=[job for job in deletion_progress(5) if job['status'] == 'running'])
 
     return render_template('admin_dashboard.html',
                            stats=stats,
-                           recent_tickets=all_tickets[:10],
-                           all_tickets=all_tickets)
+                           recent_tickets=recent_tickets)
+
+
+@app.route('/admin/metrics')
+@login_required
+def admin_metrics():
+    if not current_user.is_moderator:
+        flash('Доступ запрещен')
+        return redirect(url_for('index'))
+
+    summary = sorted(endpoint_metrics.snapshot(), key=lambda item: item['p95_ms'], reverse=True)
+    return render_template('admin_metrics.html', metrics=summary, card_cache=project_card_cache.stats())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """метрики для Prometheus: модератору или по токену METRICS_TOKEN (заголовок Authorization: Bearer)"""
+    token = os.environ.get('METRICS_TOKEN')
+    authorized = current_user.is_authenticated and current_user.is_moderator
+    if token and request.headers.get('Authorization') == f'Bearer {token}':
+        authorized = True
+    if not authorized:
+        return Response('forbidden\n', status=403, mimetype='text/plain')
+    return Response(endpoint_metrics.prometheus(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/admin/tickets')
 @login_required
+@query_budget(6)
 def admin_tickets():
     if not current_user.is_moderator:
         flash('Доступ запрещен')
@@ -1464,18 +3928,21 @@ def admin_tickets():
     status_filter = request.args.get('status', 'all')
 
     if status_filter == 'all':
-        tickets = SupportTicket.query.order_by(desc(SupportTicket.created_at)).all()
+        query = SupportTicket.query
     elif status_filter == 'open':
-        tickets = SupportTicket.query.filter(SupportTicket.status.in_(['open', 'in_progress'])).order_by(
-            desc(SupportTicket.created_at)).all()
+        query = SupportTicket.query.filter(SupportTicket.status.in_(['open', 'in_progress']))
     else:
-        tickets = SupportTicket.query.filter_by(status=status_filter).order_by(desc(SupportTicket.created_at)).all()
+        query = SupportTicket.query.filter_by(status=status_filter)
 
-    return render_template('admin_tickets.html', tickets=tickets, status_filter=status_filter)
+    tickets, next_cursor = keyset_paginate(query.options(db.joinedload(SupportTicket.user)),
+                                           SupportTicket.created_at, SupportTicket.id)
+    return render_template('admin_tickets.html', tickets=tickets, status_filter=status_filter,
+                           next_cursor=next_cursor)
 
 
 @app.route('/admin/ticket/<int:ticket_id>')
 @login_required
+@query_budget(8)
 def admin_ticket_detail(ticket_id):
     if not current_user.is_moderator:
         flash('Доступ запрещен')
@@ -1487,112 +3954,242 @@ def admin_ticket_detail(ticket_id):
     return render_template('support_ticket.html', ticket=ticket, messages=messages, admin_view=True)
 
 
-def init_db():
-    """Инициализация базы данных - ПЕРЕСОЗДАЕТ ВСЕ ТАБЛИЦЫ"""
-    with app.app_context():
-        db.drop_all()  # Удаляем все таблицы
-        db.create_all()  # Создаем заново с новыми полями
+# миграции базы данных
+def table_exists(table_name):
+    result = db.session.execute(
+        text("SELECT name FROM sqlite_master WHERE type='table' AND name=:name"), {'name': table_name})
+    return result.fetchone() is not None
 
-        # Создаем ТОЛЬКО модератора
-        moderator = User(
-            username='moderator',
-            email='moderator@test.ru',
-            is_moderator=True
-        )
-        moderator.password_hash = generate_password_hash('moderator123')
-        db.session.add(moderator)
-        db.session.commit()
 
+def column_exists(table_name, column_name):
+    result = db.session.execute(text(f"PRAGMA table_info({table_name})"))
+    return column_name in [row[1] for row in result]
 
-# Добавьте эту функцию ПЕРЕД if __name__ == '__main__':
 
-def check_and_migrate_database():
-    """Проверяет и обновляет структуру базы данных при необходимости"""
-    with app.app_context():
-        try:
-            print("🔍 Проверяем структуру базы данных...")
-
-            # Проверяем существование таблицы project
-            result = db.session.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='project'"))
-            if not result.fetchone():
-                print("❌ Таблица project не найдена. Запустите init_db() сначала.")
-                return False
-
-            # Проверяем существование полей в таблице project
-            result = db.session.execute(text("PRAGMA table_info(project)"))
-            columns = [row[1] for row in result]
-            migrations_applied = 0
-
-            # Список полей для добавления
-            fields_to_add = [
-                ('technologies', 'VARCHAR(500)'),
-                ('freelancer_id', 'INTEGER REFERENCES user(id)'),
-                ('completed_at', 'DATETIME')
-            ]
-
-            for field_name, field_type in fields_to_add:
-                if field_name not in columns:
-                    print(f"📝 Добавляем поле {field_name} в таблицу project...")
-                    db.session.execute(text(f"ALTER TABLE project ADD COLUMN {field_name} {field_type}"))
-                    migrations_applied += 1
-                    print(f"✅ Поле {field_name} добавлено!")
-                else:
-                    print(f"✅ Поле {field_name} уже существует")
-
-            # Проверяем существование таблицы project_response
-            result = db.session.execute(
-                text("SELECT name FROM sqlite_master WHERE type='table' AND name='project_response'"))
-            if not result.fetchone():
-                print("📝 Создаем таблицу project_response...")
-                db.session.execute(text("""
-                    CREATE TABLE project_response (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        project_id INTEGER NOT NULL,
-                        freelancer_id INTEGER NOT NULL,
-                        message TEXT,
-                        proposed_budget FLOAT,
-                        status VARCHAR(20) DEFAULT 'pending',
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (project_id) REFERENCES project (id),
-                        FOREIGN KEY (freelancer_id) REFERENCES user (id)
-                    )
-                """))
-                migrations_applied += 1
-                print("✅ Таблица project_response создана!")
-            else:
-                print("✅ Таблица project_response уже существует")
+def migration_legacy_columns():
+    """поля project и таблицы project_response/review из ранних версий"""
+    fields_to_add = [
+        ('technologies', 'VARCHAR(500)'),
+        ('freelancer_id', 'INTEGER REFERENCES user(id)'),
+        ('completed_at', 'DATETIME')
+    ]
+    for field_name, field_type in fields_to_add:
+        if not column_exists('project', field_name):
+            print(f"📝 Добавляем поле {field_name} в таблицу project...")
+            db.session.execute(text(f"ALTER TABLE project ADD COLUMN {field_name} {field_type}"))
 
-            if migrations_applied > 0:
-                db.session.commit()
-                print(f"🎉 Применено {migrations_applied} миграций! База данных обновлена.")
-            else:
-                print("✅ База данных уже актуальна. Миграции не требуются.")
+    ProjectResponse.__table__.create(db.session.connection(), checkfirst=True)
 
-            return True
+    if not table_exists('review'):
+        Review.__table__.create(db.session.connection())
+    elif not column_exists('review', 'freelancer_id'):
+        print("📝 Добавляем поле freelancer_id в таблицу review...")
+        db.session.execute(
+            text("ALTER TABLE review ADD COLUMN freelancer_id INTEGER NOT NULL DEFAULT 1 REFERENCES user(id)"))
 
-        except Exception as e:
-            print(f"❌ Ошибка при проверке базы данных: {e}")
-            db.session.rollback()
-            return False
 
+def migration_rating_aggregates():
+    """агрегаты рейтинга в таблице user"""
+    for field_name in ['rating_count', 'rating_sum', 'client_rating_count', 'client_rating_sum']:
+        if not column_exists('user', field_name):
+            print(f"📝 Добавляем поле {field_name} в таблицу user...")
+            db.session.execute(text(f"ALTER TABLE user ADD COLUMN {field_name} INTEGER NOT NULL DEFAULT 0"))
+    update_rating_aggregates(invalidate_sessions=False)
 
-# ОБНОВИТЕ функцию init_db() чтобы она создавала все нужные таблицы:
 
-def init_db():
-    """Инициализация базы данных - ТОЛЬКО модератор и базовые таблицы"""
+def migration_conversations():
+    """сводная таблица диалогов"""
+    Conversation.__table__.create(db.session.connection(), checkfirst=True)
+    fill_conversations()
+
+
+def migration_outbox():
+    """очередь побочных действий"""
+    OutboxEvent.__table__.create(db.session.connection(), checkfirst=True)
+
+
+def migration_project_version():
+    """версия проекта для ключей кеша карточек"""
+    if not column_exists('project', 'version'):
+        print("📝 Добавляем поле version в таблицу project...")
+        db.session.execute(text("ALTER TABLE project ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+
+def migration_user_session_version():
+    """версия пользователя для кешей сессий всех процессов"""
+    if not column_exists('user', 'session_version'):
+        print("📝 Добавляем поле session_version в таблицу user...")
+        db.session.execute(text("ALTER TABLE user ADD COLUMN session_version INTEGER NOT NULL DEFAULT 1"))
+
+
+def migration_project_updated_at():
+    """время изменения проекта для заголовка Last-Modified"""
+    if not column_exists('project', 'updated_at'):
+        print("📝 Добавляем поле updated_at в таблицу project...")
+        db.session.execute(text("ALTER TABLE project ADD COLUMN updated_at DATETIME"))
+    db.session.execute(text(
+        "UPDATE project SET updated_at = COALESCE(completed_at, created_at) WHERE updated_at IS NULL"))
+
+
+def migration_skill_tags():
+    """таблицы навыков и связей, заполняются из строковых полей"""
+    for table in [Skill.__table__, project_skill, profile_skill]:
+        table.create(db.session.connection(), checkfirst=True)
+    fill_skill_tags()
+
+
+def migration_deletion_jobs():
+    """таблица заданий удаления и индексы по ссылкам на пользователя и проект"""
+    DeletionJob.__table__.create(db.session.connection(), checkfirst=True)
+    create_model_indexes()
+
+
+def migration_coalesce_message_notifications():
+    """одно уведомление о сообщениях на пару (получатель, отправитель) вместо строки на каждое сообщение"""
+    if not column_exists('notification', 'unread_count'):
+        print("📝 Добавляем поле unread_count в таблицу notification...")
+        db.session.execute(text("ALTER TABLE notification ADD COLUMN unread_count INTEGER NOT NULL DEFAULT 0"))
+    latest = ("SELECT max(id) FROM notification WHERE notification_type = 'message' AND related_id IS NOT NULL "
+              "GROUP BY user_id, related_id")
+    db.session.execute(text(f"""
+        UPDATE notification SET unread_count = (
+            SELECT count(*) FROM notification AS other
+            WHERE other.user_id = notification.user_id AND other.related_id = notification.related_id
+              AND other.notification_type = 'message' AND other.is_read = 0
+        )
+        WHERE id IN ({latest})"""))
+    db.session.execute(text(f"UPDATE notification SET is_read = (unread_count = 0) WHERE id IN ({latest})"))
+    merged = db.session.execute(text(f"""
+        DELETE FROM notification
+        WHERE notification_type = 'message' AND related_id IS NOT NULL AND id NOT IN ({latest})""")).rowcount
+    if merged:
+        print(f"📝 Объединено уведомлений о сообщениях: {merged}")
+    create_table_indexes(Notification.__table__, unique=True)
+
+
+def migration_user_counters():
+    """счетчики в базе вместо кеша процесса"""
+    UserCounter.__table__.create(db.session.connection(), checkfirst=True)
+    fill_user_counters()
+
+
+def migration_realtime_events():
+    """события потока /api/events в базе вместо памяти процесса"""
+    RealtimeEvent.__table__.create(db.session.connection(), checkfirst=True)
+
+
+def migration_conversation_read_marks():
+    """id последнего прочитанного сообщения для каждой стороны диалога"""
+    for field_name in ['user1_last_read_id', 'user2_last_read_id']:
+        if not column_exists('conversation', field_name):
+            print(f"📝 Добавляем поле {field_name} в таблицу conversation...")
+            db.session.execute(text(f"ALTER TABLE conversation ADD COLUMN {field_name} INTEGER NOT NULL DEFAULT 0"))
+    fill_conversations(keep_read_marks=False)
+
+
+def migration_project_fts():
+    """полнотекстовый индекс project_fts и триггеры синхронизации"""
+    for ddl in PROJECT_FTS_DDL:
+        db.session.execute(text(ddl))
+    db.session.execute(text("INSERT INTO project_fts (project_fts) VALUES ('rebuild')"))
+
+
+def create_table_indexes(table, unique=False):
+    """индексы таблицы из модели; индексы по колонкам, которых еще нет, создаст более поздняя миграция
+
+    уникальные индексы создаются только своей миграцией (unique=True) - после очистки дубликатов
+    """
+    for index in table.indexes:
+        if index.unique and not unique:
+            continue
+        if all(column_exists(table.name, column.name) for column in index.columns):
+            index.create(db.session.connection(), checkfirst=True)
+
+
+def create_model_indexes():
+    """создает недостающие индексы, объявленные в моделях
+
+    таблицы, которых еще нет, пропускаются - их создаст своя миграция вместе с индексами
+    """
+    for table in db.metadata.sorted_tables:
+        if table_exists(table.name):
+            create_table_indexes(table)
+
+
+def migration_hot_path_indexes():
+    """составные индексы для основных запросов страниц"""
+    for table in [Notification.__table__, Message.__table__, Project.__table__, ProjectResponse.__table__,
+                  Review.__table__, SupportTicket.__table__, TicketMessage.__table__]:
+        create_table_indexes(table)
+
+
+# версия схемы -> (описание, функция миграции); новые миграции добавляются в конец
+MIGRATIONS = [
+    (1, 'Поля project, таблицы project_response и review', migration_legacy_columns),
+    (2, 'Агрегаты рейтинга пользователей', migration_rating_aggregates),
+    (3, 'Сводная таблица диалогов', migration_conversations),
+    (4, 'Составные индексы для основных запросов', migration_hot_path_indexes),
+    (5, 'Полнотекстовый поиск по проектам (FTS5)', migration_project_fts),
+    (6, 'Индексы для постраничной навигации', create_model_indexes),
+    (7, 'Индекс истории диалога по id сообщения', create_model_indexes),
+    (8, 'Таблица outbox для фоновых действий', migration_outbox),
+    (9, 'Версия проекта для кеша карточек', migration_project_version),
+    (10, 'Время изменения проекта для условных запросов', migration_project_updated_at),
+    (11, 'Индекс времени изменения проекта', create_model_indexes),
+    (12, 'Нормализованные навыки проектов и профилей', migration_skill_tags),
+    (13, 'Фоновое удаление и индексы для каскадов', migration_deletion_jobs),
+    (14, 'Сводные уведомления о сообщениях', migration_coalesce_message_notifications),
+    (15, 'Отметки прочтения диалогов вместо message.is_read', migration_conversation_read_marks),
+    (16, 'Таблица realtime_event для потоков событий всех воркеров', migration_realtime_events),
+    (17, 'Счетчики непрочитанных уведомлений в таблице user_counter', migration_user_counters),
+    (18, 'Версия пользователя для кеша сессий', migration_user_session_version),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version():
+    db.session.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migration (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(200),
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    return db.session.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migration")).scalar()
+
+
+def record_schema_version(version, description):
+    db.session.execute(
+        text("INSERT INTO schema_migration (version, description) VALUES (:version, :description)"),
+        {'version': version, 'description': description}
+    )
+
+
+def stamp_schema_version():
+    """отмечает все миграции примененными (для базы, созданной через create_all)"""
+    current_version = get_schema_version()
+    for version, description, _ in MIGRATIONS:
+        if version > current_version:
+            record_schema_version(version, description)
+
+
+def create_database():
+    """Создает таблицы и модератора в новой базе; существующие таблицы и данные не трогает"""
     with app.app_context():
-        db.drop_all()
         db.create_all()
+        stamp_schema_version()
 
         # Создаем ТОЛЬКО модератора
-        moderator = User(
-            username='moderator',
-            email='moderator@test.ru',
-            is_moderator=True
-        )
-        moderator.password_hash = generate_password_hash('moderator123')
-
-        db.session.add(moderator)
+        if not User.query.filter_by(email='moderator@test.ru').first():
+            moderator = User(
+                username='moderator',
+                email='moderator@test.ru',
+                is_moderator=True
+            )
+            moderator.password_hash = hash_password('moderator123')
+            db.session.add(moderator)
+            db.session.flush()
+            db.session.add(UserCounter(user_id=moderator.id, name='notifications', value=0))
         db.session.commit()
 
         print("✅ База данных инициализирована!")
@@ -1604,43 +4201,32 @@ def init_db():
         print("3. Тестируйте функционал с чистого листа")
 
 
-def migrate_database():
-    """Миграция базы данных для добавления недостающих таблиц и полей"""
+def init_db():
+    """Инициализация базы данных - ПЕРЕСОЗДАЕТ ВСЕ ТАБЛИЦЫ, только для ручного запуска"""
     with app.app_context():
-        try:
-            print("🔄 Проверяем необходимость миграций...")
-
-            # Проверяем существование таблицы review
-            result = db.session.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='review'"))
-            if not result.fetchone():
-                print("📝 Создаем таблицу review...")
-                db.session.execute(text("""
-                    CREATE TABLE review (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        project_id INTEGER NOT NULL,
-                        reviewer_id INTEGER NOT NULL,
-                        freelancer_id INTEGER NOT NULL,
-                        rating INTEGER NOT NULL,
-                        comment TEXT,
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (project_id) REFERENCES project (id),
-                        FOREIGN KEY (reviewer_id) REFERENCES user (id),
-                        FOREIGN KEY (freelancer_id) REFERENCES user (id)
-                    )
-                """))
-                print("✅ Таблица review создана!")
-            else:
-                # Проверяем существование поля freelancer_id в таблице review
-                result = db.session.execute(text("PRAGMA table_info(review)"))
-                columns = [row[1] for row in result]
+        db.drop_all()
+        db.session.execute(text("DROP TABLE IF EXISTS schema_migration"))
+        db.session.commit()
+    create_database()
 
-                if 'freelancer_id' not in columns:
-                    print("📝 Добавляем поле freelancer_id в таблицу review...")
-                    db.session.execute(text("ALTER TABLE review ADD COLUMN freelancer_id INTEGER NOT NULL DEFAULT 1"))
-                    db.session.execute(text("ALTER TABLE review ADD FOREIGN KEY (freelancer_id) REFERENCES user(id)"))
-                    print("✅ Поле freelancer_id добавлено!")
 
+def migrate_database():
+    """Применяет недостающие миграции по порядку, каждую в своей транзакции"""
+    with app.app_context():
+        try:
+            current_version = get_schema_version()
             db.session.commit()
+            print(f"🔄 Версия схемы: {current_version}, актуальная: {SCHEMA_VERSION}")
+
+            for version, description, migration in MIGRATIONS:
+                if version <= current_version:
+                    continue
+                print(f"📝 Миграция {version}: {description}...")
+                migration()
+                record_schema_version(version, description)
+                db.session.commit()
+                print(f"✅ Миграция {version} применена")
+
             print("🎉 Миграция базы данных завершена!")
             return True
 
@@ -1650,15 +4236,450 @@ def migrate_database():
             return False
 
 
+def check_and_migrate_database():
+    """Проверяет и обновляет структуру базы данных при необходимости"""
+    with app.app_context():
+        print("🔍 Проверяем структуру базы данных...")
+
+        if not table_exists('project'):
+            print("❌ Таблица project не найдена. Запустите init_db() сначала.")
+            return False
+
+    return migrate_database()
+
+
+def hot_path_queries():
+    """основные запросы страниц для проверки планов выполнения"""
+    user_id, other_id, project_id = 1, 2, 1
+    return {
+        'index': Project.query.filter_by(status='open').order_by(Project.created_at.desc()).limit(6),
+        'projects': Project.query.filter(Project.status != 'hidden').filter_by(status='open')
+        .order_by(Project.created_at.desc()),
+        'project_search': search_projects(Project.query.filter_by(status='open'), 'python')[0],
+        'project_responses': ProjectResponse.query.filter_by(project_id=project_id),
+        'respond_check': ProjectResponse.query.filter_by(project_id=project_id, freelancer_id=user_id),
+        'client_projects': Project.query.filter(Project.client_id == user_id,
+                                                Project.status.in_(['open', 'in_progress']))
+        .order_by(Project.created_at.desc()),
+        'freelancer_projects': Project.query.filter(Project.freelancer_id == user_id, Project.status == 'completed'),
+        'freelancer_reviews': Review.query.filter_by(freelancer_id=user_id).order_by(Review.created_at.desc()),
+        'notifications': Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()),
+        'unread_notifications': Notification.query.filter_by(user_id=user_id, is_read=False),
+        'unread_messages': unread_messages_query(user_id),
+        'chat_messages': chat_messages_query(user_id, other_id, before_id=1000),
+        'mark_chat_read': db.update(Conversation).where(
+            Conversation.user1_id == user_id, Conversation.user2_id == other_id
+        ).values(user1_last_read_id=Conversation.last_message_id, user1_unread=0),
+        'chat_list': Conversation.query.filter(
+            db.or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id)
+        ).order_by(Conversation.last_message_id.desc()),
+        'support': SupportTicket.query.filter_by(user_id=user_id).order_by(SupportTicket.created_at.desc()),
+        'admin_open_tickets': SupportTicket.query.filter(SupportTicket.status.in_(['open', 'in_progress'])),
+        'admin_users': admin_users_query()[0].order_by(User.created_at.desc()).limit(PER_PAGE),
+        'dashboard_projects': db.session.query(Project.status, db.func.count()).group_by(Project.status),
+        'dashboard_tickets': db.session.query(SupportTicket.status, db.func.count()).group_by(SupportTicket.status),
+        'ticket_messages': TicketMessage.query.filter_by(ticket_id=1).order_by(TicketMessage.created_at.asc()),
+        'login': User.query.filter_by(email='moderator@test.ru'),
+        'outbox_claim': db.select(OutboxEvent.id).where(
+            OutboxEvent.status.in_(['pending', 'processing']),
+            OutboxEvent.available_at <= datetime(2000, 1, 1)
+        ).order_by(OutboxEvent.id).limit(OUTBOX_BATCH_SIZE),
+        'projects_by_skill': filter_by_skills(Project.query.filter_by(status='open'), {'python', 'sql'})
+        .order_by(Project.created_at.desc()),
+        **{f'delete_user_{number}': db.select(db.literal_column('rowid')).select_from(table).where(condition)
+           for number, (table, condition) in enumerate(user_deletion_steps(user_id))},
+        'clear_message_notifications': db.update(Notification).where(
+            Notification.user_id == user_id, Notification.related_id == other_id,
+            Notification.notification_type == 'message', Notification.is_read == False  # noqa: E712
+        ).values(is_read=True),
+        'realtime_events': realtime_events_after(user_id, 1000),
+        'notification_counter': notification_counter_query(user_id),
+        'realtime_prune': db.delete(RealtimeEvent).where(RealtimeEvent.created_at < datetime(2000, 1, 1)),
+        'skill_index_open': db.session.query(Project.id, Project.status, Project.skills_required)
+        .filter(Project.status == 'open'),
+        'skill_index_sync': db.session.query(Project.id, Project.status, Project.skills_required)
+        .filter(Project.updated_at >= datetime(2000, 1, 1)),
+    }
+
+
+def check_query_plans(verbose=False):
+    """EXPLAIN QUERY PLAN для основных запросов; False, если какой-то из них читает таблицу целиком"""
+    with app.app_context():
+        full_scans = []
+        for name, query in hot_path_queries().items():
+            statement = getattr(query, 'statement', query)
+            sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+            plan = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + sql).fetchall()
+            details = [row[-1] for row in plan]
+            if verbose:
+                print(f"{name}: {' | '.join(details)}")
+            for detail in details:
+                # "SCAN <table>" без индекса - полный просмотр таблицы;
+                # SCAN anon_N читает уже ограниченный результат подзапроса
+                if (detail.startswith('SCAN') and 'INDEX' not in detail and 'CONSTANT ROW' not in detail
+                        and not detail.startswith('SCAN anon_')):
+                    full_scans.append((name, detail))
+
+        for name, detail in full_scans:
+            print(f"❌ {name}: {detail}")
+        if not full_scans:
+            print(f"✅ Все {len(hot_path_queries())} запросов используют индексы")
+        return not full_scans
+
+
+def concurrency_benchmark_setup():
+    """таблицы и тестовые данные для benchmark_concurrency - только для временной базы (DATABASE_URL)"""
+    with app.app_context():
+        db.create_all()
+        users = [User(username=f'bench{i}', email=f'bench{i}@test.ru') for i in range(2)]
+        db.session.add_all(users)
+        db.session.flush()
+        for i in range(500):
+            db.session.add(Project(title=f'Проект {i}', description='Тестовый проект', budget=100,
+                                   category='Разработка', client_id=users[0].id))
+        db.session.commit()
+
+
+def concurrency_benchmark_worker(kind, start_at, seconds):
+    """один процесс нагрузки: reader - список проектов и счетчик, writer - отправка сообщения"""
+    counts = {'operations': 0, 'errors': 0}
+    latencies = []
+    with app.app_context():
+        sender_id, receiver_id = db.session.scalars(db.select(User.id).order_by(User.id).limit(2)).all()
+        db.session.commit()
+
+    def read():
+        Project.query.filter_by(status='open').order_by(Project.created_at.desc()).limit(PER_PAGE).all()
+        count_unread_messages(receiver_id)
+
+    def write():
+        message = Message(sender_id=sender_id, receiver_id=receiver_id, content='Тестовое сообщение')
+        db.session.add(message)
+        record_message(message)
+        db.session.commit()
+
+    operation = read if kind == 'reader' else write
+    time.sleep(max(0, start_at - time.time()))
+    deadline = start_at + seconds
+    while time.time() < deadline:
+        started = time.perf_counter()
+        with app.app_context():
+            try:
+                operation()
+                counts['operations'] += 1
+            except sa_exc.OperationalError:
+                db.session.rollback()
+                counts['errors'] += 1
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    counts['p95_ms'] = round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else 0
+    return counts
+
+
+def benchmark_concurrency(readers=4, writers=2, seconds=5):
+    """сравнение профилей SQLite: параллельные процессы читают и пишут одну временную базу"""
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for profile in SQLITE_PROFILES:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, SQLITE_PROFILE=profile, OUTBOX_WORKERS='0',
+                       DATABASE_URL='sqlite:///' + os.path.join(directory, 'benchmark.db'))
+            subprocess.run([sys.executable, '-c', 'from app import concurrency_benchmark_setup as s; s()'],
+                           env=env, cwd=project_dir, check=True, capture_output=True)
+
+            start_at = time.time() + 3  # все процессы начинают одновременно, после импорта приложения
+            workers = []
+            for kind in ['reader'] * readers + ['writer'] * writers:
+                code = ('import json; from app import concurrency_benchmark_worker as w; '
+                        f'print(json.dumps(w({kind!r}, {start_at}, {seconds})))')
+                workers.append((kind, subprocess.Popen([sys.executable, '-c', code], env=env, cwd=project_dir,
+                                                       stdout=subprocess.PIPE, text=True)))
+
+            totals = {'reads': 0, 'writes': 0, 'errors': 0}
+            read_p95 = 0
+            for kind, process in workers:
+                output, _ = process.communicate()
+                counts = json.loads(output.strip().splitlines()[-1])
+                totals['reads' if kind == 'reader' else 'writes'] += counts['operations']
+                totals['errors'] += counts['errors']
+                if kind == 'reader':
+                    read_p95 = max(read_p95, counts['p95_ms'])
+            results[profile] = {name: round(value / seconds, 1) for name, value in totals.items()}
+            results[profile]['read_p95_ms'] = read_p95
+
+        print(f"📊 {profile}: чтений {results[profile]['reads']}/с, записей {results[profile]['writes']}/с, "
+              f"ошибок блокировки {results[profile]['errors']}/с, p95 чтения {read_p95} мс")
+    return results
+
+# тестовые данные в реалистичных объемах и замеры основных страниц
+SEED_CHUNK_SIZE = 10000
+SEED_PASSWORD = 'password'
+SEED_CATEGORIES = ['Разработка', 'Дизайн', 'Маркетинг', 'Тексты', 'Консультация', 'Администрирование']
+SEED_SKILLS = ['Python', 'Flask', 'Django', 'SQL', 'JavaScript', 'React', 'Vue', 'Figma', 'Photoshop', 'SEO',
+               'SMM', 'Копирайтинг', 'Docker', 'Linux', 'PostgreSQL', 'SQLite', 'HTML', 'CSS', 'Go', 'Java']
+SEED_TITLES = ['Сайт', 'Лендинг', 'Интернет-магазин', 'Телеграм-бот', 'Логотип', 'Статья', 'Парсер', 'REST API',
+               'Мобильное приложение', 'Рекламная кампания', 'CRM', 'Интеграция', 'Верстка', 'Настройка сервера']
+SEED_STATUSES = ['open'] * 40 + ['in_progress'] * 15 + ['completed'] * 35 + ['cancelled'] * 5 + ['hidden'] * 5
+SEED_RATINGS = [1] * 3 + [2] * 4 + [3] * 10 + [4] * 33 + [5] * 50
+SEED_NOTIFICATIONS = [
+    ('project_response', 'Новый отклик на ваш проект!'),
+    ('project_response', 'Отклик отклонен'),
+    ('project_accepted', 'Ваш отклик принят!'),
+    ('project_completed', 'Проект завершен!'),
+    ('message', 'Новое сообщение'),
+    ('review', 'Новый отзыв!'),
+    ('system', 'Профиль создан!'),
+]
+
+
+def insert_chunks(model, rows):
+    """массовая вставка: executemany пачками по SEED_CHUNK_SIZE строк, каждая пачка - своя транзакция"""
+    chunk, total = [], 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= SEED_CHUNK_SIZE:
+            db.session.execute(db.insert(model), chunk)
+            db.session.commit()
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(db.insert(model), chunk)
+        db.session.commit()
+        total += len(chunk)
+    return total
+
+
+def seed_database(users=100_000, projects=500_000, messages=2_000_000, notifications=2_000_000, seed=42):
+    """заполняет базу тестовыми данными: пользователи, проекты с откликами и отзывами, переписка, уведомления
+
+    активность неравномерная: небольшая часть заказчиков создает большую часть проектов, число откликов
+    и длина переписки распределены по степенному закону. Пароль всех созданных пользователей - SEED_PASSWORD
+    """
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+
+    def skewed(items, power=2.5):
+        # первые элементы выбираются намного чаще остальных
+        return items[int(len(items) * rnd.random() ** power)]
+
+    def random_time(after=None):
+        start = after or now - timedelta(days=365)
+        return start + (now - start) * rnd.random()
+
+    with app.app_context():
+        started = time.perf_counter()
+
+        # пользователи: 30% заказчиков, у 80% фрилансеров заполнен профиль
+        first_user_id = (db.session.scalar(db.select(db.func.max(User.id))) or 0) + 1
+        password_hash = hash_password(SEED_PASSWORD)
+        clients, freelancers = [], []
+
+        def user_rows():
+            for user_id in range(first_user_id, first_user_id + users):
+                is_client = rnd.random() < 0.3
+                (clients if is_client else freelancers).append(user_id)
+                yield {'id': user_id, 'username': f'seed{user_id}', 'email': f'seed{user_id}@example.com',
+                       'password_hash': password_hash, 'is_client': is_client, 'created_at': random_time()}
+
+        insert_chunks(User, user_rows())
+        if not clients or not freelancers:
+            print("❌ Слишком мало пользователей для заказчиков и фрилансеров")
+            return
+        rnd.shuffle(clients)
+        rnd.shuffle(freelancers)
+
+        def profile_rows():
+            for user_id in freelancers:
+                if rnd.random() < 0.8:
+                    yield {'user_id': user_id, 'full_name': f'Фрилансер {user_id}', 'title': rnd.choice(SEED_TITLES),
+                           'description': 'Опытный специалист', 'skills': ', '.join(rnd.sample(SEED_SKILLS, 4)),
+                           'hourly_rate': round(rnd.lognormvariate(7, 0.6)), 'experience': str(rnd.randint(1, 15))}
+
+        insert_chunks(Profile, profile_rows())
+        print(f"✅ Пользователей: {users}")
+
+        # проекты; назначенный исполнитель есть у проектов в работе и завершенных
+        first_project_id = (db.session.scalar(db.select(db.func.max(Project.id))) or 0) + 1
+        assigned = []  # (project_id, client_id, freelancer_id, status, created_at)
+        open_projects = []
+
+        def project_rows():
+            for project_id in range(first_project_id, first_project_id + projects):
+                client_id = skewed(clients)
+                status = rnd.choice(SEED_STATUSES)
+                created_at = random_time()
+                freelancer_id = skewed(freelancers) if status in ('in_progress', 'completed') else None
+                if freelancer_id:
+                    assigned.append((project_id, client_id, freelancer_id, status, created_at))
+                elif status == 'open':
+                    open_projects.append((project_id, created_at))
+                title = rnd.choice(SEED_TITLES)
+                yield {'id': project_id, 'title': f'{title} #{project_id}', 'description': f'Нужен {title.lower()} под ключ',
+                       'budget': round(rnd.lognormvariate(10, 1)), 'category': rnd.choice(SEED_CATEGORIES),
+                       'skills_required': ', '.join(rnd.sample(SEED_SKILLS, 3)),
+                       'technologies': ', '.join(rnd.sample(SEED_SKILLS, 2)), 'status': status,
+                       'client_id': client_id, 'freelancer_id': freelancer_id, 'created_at': created_at,
+                       'completed_at': random_time(created_at) if status == 'completed' else None,
+                       'updated_at': created_at}
+
+        insert_chunks(Project, project_rows())
+        print(f"✅ Проектов: {projects}")
+
+        # отклики: у большинства проектов несколько, у немногих - десятки
+        def response_rows():
+            for project_id, created_at in open_projects:
+                for freelancer_id in rnd.sample(freelancers, min(int(rnd.paretovariate(1.2)) - 1, 100, len(freelancers))):
+                    yield {'project_id': project_id, 'freelancer_id': freelancer_id, 'message': 'Готов взяться',
+                           'proposed_budget': round(rnd.lognormvariate(10, 1)), 'status': 'pending',
+                           'created_at': random_time(created_at)}
+            for project_id, client_id, chosen_id, status, created_at in assigned:
+                yield {'project_id': project_id, 'freelancer_id': chosen_id, 'message': 'Готов взяться',
+                       'proposed_budget': round(rnd.lognormvariate(10, 1)), 'status': 'accepted',
+                       'created_at': random_time(created_at)}
+                for freelancer_id in rnd.sample(freelancers, min(int(rnd.paretovariate(1.2)) - 1, 100, len(freelancers))):
+                    if freelancer_id != chosen_id:
+                        yield {'project_id': project_id, 'freelancer_id': freelancer_id, 'message': 'Готов взяться',
+                               'proposed_budget': round(rnd.lognormvariate(10, 1)), 'status': 'rejected',
+                               'created_at': random_time(created_at)}
+
+        print(f"✅ Откликов: {insert_chunks(ProjectResponse, response_rows())}")
+
+        # отзывы: по 70% завершенных проектов, оценки смещены к 4-5
+        def review_rows():
+            for project_id, client_id, freelancer_id, status, created_at in assigned:
+                if status == 'completed' and rnd.random() < 0.7:
+                    yield {'project_id': project_id, 'reviewer_id': client_id, 'freelancer_id': freelancer_id,
+                           'rating': rnd.choice(SEED_RATINGS), 'comment': 'Спасибо за работу',
+                           'created_at': random_time(created_at)}
+
+        print(f"✅ Отзывов: {insert_chunks(Review, review_rows())}")
+
+        # переписка: диалоги заказчиков с исполнителями и случайные; id и время сообщений растут вместе
+        pairs = [(client_id, freelancer_id) for _, client_id, freelancer_id, _, _ in assigned]
+        pairs += [(skewed(clients), skewed(freelancers)) for _ in range(max(1, len(pairs) // 2))]
+        rnd.shuffle(pairs)
+        start, step = now - timedelta(days=365), timedelta(days=365) / max(messages, 1)
+
+        def message_rows():
+            for number in range(messages):
+                client_id, freelancer_id = skewed(pairs, power=2)
+                sender_id, receiver_id = (client_id, freelancer_id) if rnd.random() < 0.5 else (freelancer_id, client_id)
+                yield {'sender_id': sender_id, 'receiver_id': receiver_id, 'content': 'Добрый день! Как продвигается работа?',
+                       'is_read': number < messages * 0.98 or rnd.random() < 0.5, 'created_at': start + step * number}
+
+        insert_chunks(Message, message_rows())
+        print(f"✅ Сообщений: {messages}")
+
+        all_users = clients + freelancers
+        rnd.shuffle(all_users)
+
+        def notification_rows():
+            # о сообщениях - одно сводное уведомление на пару получатель/отправитель из переписки
+            senders = set()
+            for _ in range(notifications):
+                notification_type, title = rnd.choice(SEED_NOTIFICATIONS)
+                user_id, related_id, is_read = skewed(all_users, power=2), None, rnd.random() < 0.7
+                if notification_type == 'message':
+                    user_id, related_id = rnd.sample(skewed(pairs, power=2), 2)
+                    if (user_id, related_id) in senders:
+                        continue
+                    senders.add((user_id, related_id))
+                yield {'user_id': user_id, 'title': title, 'message': title, 'notification_type': notification_type,
+                       'is_read': is_read, 'related_id': related_id, 'created_at': random_time(),
+                       'unread_count': int(related_id is not None and not is_read)}
+
+        print(f"✅ Уведомлений: {insert_chunks(Notification, notification_rows())}")
+
+        # производные данные и статистика планировщика
+        fill_skill_tags()
+        fill_conversations()
+        update_rating_aggregates()
+        db.session.commit()
+        db.session.execute(text('ANALYZE'))
+        fill_user_counters()
+        db.session.commit()
+        project_card_cache.invalidate()
+        skill_index.invalidate()
+        dashboard_stats_cache.invalidate()
+        print(f"🎉 Тестовые данные созданы за {time.perf_counter() - started:.1f} с")
+
+
+def benchmark_routes(rounds=20):
+    """латентность и число SQL-запросов основных страниц через тестовый клиент
+
+    запускать после seed_database: заказчик выбирается среди созданных пользователей (пароль SEED_PASSWORD)
+    """
+    with app.app_context():
+        client_id = db.session.execute(
+            db.select(Project.client_id).join(User, User.id == Project.client_id).where(User.email.like('seed%'))
+            .group_by(Project.client_id).order_by(db.func.count().desc()).limit(1)
+        ).scalar()
+        project_id = db.session.execute(
+            db.select(ProjectResponse.project_id).group_by(ProjectResponse.project_id)
+            .order_by(db.func.count().desc()).limit(1)
+        ).scalar()
+        if client_id is None or project_id is None:
+            print("❌ Нет тестовых данных. Запустите seed_database()")
+            return
+        client_email = db.session.get(User, client_id).email
+        chats = get_user_chats(client_id)
+        partner_id = chats[0]['other_user'].id if chats else client_id
+
+    anonymous, client, moderator = app.test_client(), app.test_client(), app.test_client()
+    client.post('/login', data={'email': client_email, 'password': SEED_PASSWORD})
+    moderator.post('/login', data={'email': 'moderator@test.ru', 'password': 'moderator123'})
+
+    routes = [
+        (anonymous, '/'),
+        (anonymous, '/projects'),
+        (anonymous, '/projects?search=сайт'),
+        (anonymous, f'/project/{project_id}'),
+        (client, '/'),
+        (client, '/chats'),
+        (client, f'/chats?user_id={partner_id}'),
+        (client, '/notifications'),
+        (moderator, '/admin'),
+        (moderator, '/admin/users'),
+        (moderator, '/admin/projects'),
+    ]
+
+    results = []
+    print(f"{'маршрут':<40} {'p50, мс':>9} {'p95, мс':>9} {'макс, мс':>9} {'SQL':>5}")
+    for test_client, path in routes:
+        test_client.get(path)  # прогрев кешей
+        latencies, statements = [], 0
+        for _ in range(rounds):
+            started = time.perf_counter()
+            response = test_client.get(path)
+            latencies.append(time.perf_counter() - started)
+            match = re.search(r'SQL x(\d+)', response.headers.get('Server-Timing', ''))
+            statements = max(statements, int(match.group(1)) if match else 0)
+        latencies.sort()
+        result = {
+            'path': path,
+            'status': response.status_code,
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+            'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+            'max_ms': round(latencies[-1] * 1000, 1),
+            'sql_statements': statements,
+        }
+        results.append(result)
+        label = path if test_client is not anonymous else f'{path} (аноним)'
+        print(f"{label:<40} {result['p50_ms']:>9} {result['p95_ms']:>9} {result['max_ms']:>9} {statements:>5}")
+    return results
+
+
 if __name__ == '__main__':
-    # Проверяем и обновляем базу данных при каждом запуске
-    if not os.path.exists('instance/freelance.db'):
+    # Проверяем и обновляем базу данных при каждом запуске (DATABASE_URL или instance/freelance.db);
+    # при запуске таблицы только создаются, drop_all вызывает лишь init_db
+    with app.app_context():
+        database_exists = db.inspect(db.engine).has_table('user')
+    if not database_exists:
         print("🆕 База данных не найдена. Создаем новую...")
-        init_db()
+        create_database()
     else:
         print("🔍 База данных найдена. Проверяем структуру...")
         check_and_migrate_database()
-        migrate_database()  # Добавляем вызов функции миграции
 
     print("🚀 Запуск приложения...")
-    app.run(debug=True, port=5001, host='0.0.0.0')
+    app.run(debug=os.environ.get('FLASK_DEBUG', '1') == '1', port=5001, host='0.0.0.0', threaded=True)
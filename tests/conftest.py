@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# приложение читает DATABASE_URL при импорте - временная база задается до него
+DATABASE_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DATABASE_DIR, 'test.db')
+os.environ['OUTBOX_WORKERS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as freelance  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """чистая база с модератором для каждого теста"""
+    freelance.app.config['TESTING'] = True
+    freelance.init_db()
+    freelance.user_cache.invalidate()  # id и версии пользователей новой базы начинаются заново
+    yield freelance.app
+
+
+@pytest.fixture(scope='module')
+def seeded_app():
+    """небольшая база с тестовыми данными, одна на модуль тестов"""
+    freelance.app.config['TESTING'] = True
+    freelance.init_db()
+    freelance.seed_database(users=300, projects=1000, messages=3000, notifications=3000)
+    return freelance.app
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        yield freelance.db
+        freelance.db.session.rollback()
@@ -0,0 +1,33 @@
+import app as freelance
+
+
+def register_client(app):
+    client = app.test_client()
+    client.post('/register', data={'username': 'client', 'email': 'client@test.ru',
+                                   'password': 'secret', 'user_type': 'client'}, follow_redirects=True)
+    with app.app_context():
+        user = freelance.User.query.filter_by(email='client@test.ru').one()
+        project = freelance.Project(title='Сайт', description='Лендинг', budget=1000, category='Веб',
+                                    skills_required='html', client_id=user.id)
+        freelance.db.session.add(project)
+        freelance.db.session.commit()
+        return client, project.id
+
+
+def test_unchanged_project_page_is_not_modified(app):
+    client, project_id = register_client(app)
+    etag = client.get(f'/project/{project_id}').headers['ETag']
+
+    assert client.get(f'/project/{project_id}', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_client_profile_changes_project_etag(app):
+    client, project_id = register_client(app)
+    etag = client.get(f'/project/{project_id}').headers['ETag']
+
+    client.post('/profile/create', data={'full_name': 'Иван', 'title': 'Заказчик', 'description': 'Новое описание',
+                                         'skills': '', 'hourly_rate': '', 'experience': ''}, follow_redirects=True)
+    response = client.get(f'/project/{project_id}', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert 'Новое описание' in response.get_data(as_text=True)
@@ -0,0 +1,60 @@
+import threading
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import app as freelance
+
+
+@pytest.fixture
+def stream(app, monkeypatch):
+    monkeypatch.setattr(freelance, 'SSE_KEEPALIVE_SECONDS', 0.1)
+    monkeypatch.setattr(freelance.realtime_watcher, 'interval', 0.05)
+    client = app.test_client()
+    client.post('/login', data={'email': 'moderator@test.ru', 'password': 'moderator123'})
+    response = client.get('/api/events', buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    # подключение читает пропущенное, запуск наблюдателя будит поток еще раз
+    for _ in range(2):
+        assert next(chunks) == b': keepalive\n\n'
+    yield chunks
+    response.close()
+
+
+def test_idle_stream_runs_no_queries(stream):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        # наблюдатель процесса работает в своем потоке - считаются запросы самого потока событий
+        if threading.current_thread() is threading.main_thread():
+            statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        chunks = [next(stream) for _ in range(5)]
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+
+    assert all(chunk == b': keepalive\n\n' for chunk in chunks)
+    assert statements == []
+
+
+def test_event_from_other_worker_is_delivered(app, stream):
+    with app.app_context():
+        moderator_id = freelance.User.query.filter_by(email='moderator@test.ru').one().id
+        # запись мимо сессии процесса, как из другого воркера: event_bus о ней не знает
+        with freelance.db.engine.begin() as connection:
+            connection.execute(freelance.db.insert(freelance.RealtimeEvent).values(
+                user_id=moderator_id, event='notification', data='{"title": "other"}',
+                created_at=datetime.now(timezone.utc)))
+
+    for _ in range(100):
+        chunk = next(stream)
+        if b'event: notification' in chunk:
+            assert b'"other"' in chunk
+            break
+    else:
+        pytest.fail('событие другого воркера не доставлено')
@@ -0,0 +1,51 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import app as freelance
+
+
+def add_event(db, **fields):
+    moderator = freelance.User.query.filter_by(email='moderator@test.ru').one()
+    outbox_event = freelance.OutboxEvent(event_type='notify_users', payload=json.dumps({
+        'user_ids': [moderator.id], 'title': 'Тест', 'message': 'Тест'}), **fields)
+    db.session.add(outbox_event)
+    db.session.commit()
+    return outbox_event.id
+
+
+def test_empty_queue_does_not_write(db):
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', collect)
+    try:
+        assert freelance.process_outbox() == 0
+    finally:
+        event.remove(Engine, 'before_cursor_execute', collect)
+
+    assert statements and all(statement.startswith('SELECT') for statement in statements)
+
+
+def test_expired_lease_is_retried(db):
+    # воркер взял событие и упал: аренда истекла, попытки еще остались
+    event_id = add_event(db, status='processing', attempts=1,
+                         available_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+    assert freelance.process_outbox() == 1
+    assert db.session.get(freelance.OutboxEvent, event_id) is None
+
+
+def test_expired_lease_on_last_attempt_fails(db):
+    event_id = add_event(db, status='processing', attempts=freelance.OUTBOX_MAX_ATTEMPTS,
+                         available_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+    assert freelance.process_outbox() == 0
+    outbox_event = db.session.get(freelance.OutboxEvent, event_id)
+    assert outbox_event.status == 'failed'
+    assert outbox_event.attempts == freelance.OUTBOX_MAX_ATTEMPTS
+    assert outbox_event.last_error
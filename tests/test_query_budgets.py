@@ -0,0 +1,95 @@
+import pytest
+
+import app as freelance
+
+
+@pytest.fixture(scope='module')
+def seeded(seeded_app):
+    """клиенты для базы с тестовыми данными: аноним, заказчик, фрилансер, модератор"""
+    app = seeded_app
+    with app.app_context():
+        db = freelance.db
+        client_id = db.session.scalar(
+            db.select(freelance.Project.client_id).group_by(freelance.Project.client_id)
+            .order_by(db.func.count().desc()).limit(1))
+        freelancer_id = db.session.scalar(
+            db.select(freelance.ProjectResponse.freelancer_id).join(
+                freelance.Profile, freelance.Profile.user_id == freelance.ProjectResponse.freelancer_id
+            ).group_by(freelance.ProjectResponse.freelancer_id).order_by(db.func.count().desc()).limit(1))
+        project_id = db.session.scalar(
+            db.select(freelance.ProjectResponse.project_id).group_by(freelance.ProjectResponse.project_id)
+            .order_by(db.func.count().desc()).limit(1))
+        partner_id = freelance.get_user_chats(client_id)[0]['other_user'].id
+        emails = {user.id: user.email for user in freelance.User.query.filter(
+            freelance.User.id.in_([client_id, freelancer_id]))}
+
+    clients = {name: app.test_client() for name in ('anonymous', 'client', 'freelancer', 'moderator')}
+    clients['client'].post('/login', data={'email': emails[client_id], 'password': freelance.SEED_PASSWORD})
+    clients['freelancer'].post('/login', data={'email': emails[freelancer_id], 'password': freelance.SEED_PASSWORD})
+    clients['moderator'].post('/login', data={'email': 'moderator@test.ru', 'password': 'moderator123'})
+    clients['client'].post('/support/create', data={'subject': 'Вопрос', 'category': 'Другое', 'description': 'Текст'})
+    with app.app_context():
+        ticket_id = freelance.db.session.scalar(db.select(db.func.max(freelance.SupportTicket.id)))
+
+    ids = {'client_id': client_id, 'freelancer_id': freelancer_id, 'project_id': project_id,
+           'partner_id': partner_id, 'ticket_id': ticket_id}
+    return clients, ids
+
+
+BUDGETED_PAGES = [
+    ('anonymous', '/'),
+    ('anonymous', '/projects'),
+    ('anonymous', '/projects?search=сайт'),
+    ('anonymous', '/projects?skill=python,sql&skill_mode=any'),
+    ('anonymous', '/project/{project_id}'),
+    ('client', '/'),
+    ('client', '/projects'),
+    ('client', '/project/{project_id}'),
+    ('client', '/profile'),
+    ('client', '/profile/{freelancer_id}'),
+    ('client', '/notifications'),
+    ('client', '/chats'),
+    ('client', '/chats?user_id={partner_id}'),
+    ('client', '/support'),
+    ('client', '/support/ticket/{ticket_id}'),
+    ('freelancer', '/profile'),
+    ('freelancer', '/api/recommendations'),
+    ('freelancer', '/chats'),
+    ('moderator', '/admin'),
+    ('moderator', '/admin/users'),
+    ('moderator', '/admin/projects'),
+    ('moderator', '/admin/tickets'),
+    ('moderator', '/admin/ticket/{ticket_id}'),
+]
+
+
+def endpoint_for(path):
+    path = path.format(client_id=1, freelancer_id=1, project_id=1, partner_id=1, ticket_id=1)
+    return freelance.app.url_map.bind('localhost').match(path.split('?')[0])[0]
+
+
+@pytest.mark.parametrize('client_name, path', BUDGETED_PAGES)
+def test_page_within_query_budget(seeded, client_name, path):
+    clients, ids = seeded
+    # при TESTING превышение бюджета - исключение QueryBudgetExceeded из тестового клиента
+    response = clients[client_name].get(path.format(**ids))
+    assert response.status_code == 200
+
+
+def test_every_budgeted_route_is_covered():
+    covered = {endpoint_for(path) for _, path in BUDGETED_PAGES}
+    assert set(freelance.QUERY_BUDGETS) <= covered
+
+
+def test_exceeding_budget_raises(seeded, monkeypatch):
+    clients, _ = seeded
+    monkeypatch.setitem(freelance.QUERY_BUDGETS, 'index', 1)
+    with pytest.raises(freelance.QueryBudgetExceeded):
+        clients['client'].get('/')
+
+
+def test_exceeding_budget_only_warns_outside_tests(seeded, monkeypatch):
+    clients, _ = seeded
+    monkeypatch.setitem(freelance.QUERY_BUDGETS, 'index', 1)
+    monkeypatch.setitem(freelance.app.config, 'TESTING', False)
+    assert clients['client'].get('/').status_code == 200
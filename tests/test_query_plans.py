@@ -0,0 +1,6 @@
+import app as freelance
+
+
+def test_hot_path_queries_use_indexes(seeded_app, capsys):
+    # при провале в сообщении - строки плана с полным просмотром таблицы
+    assert freelance.check_query_plans(verbose=True), capsys.readouterr().out
@@ -0,0 +1,15 @@
+import app as freelance
+
+
+def test_query_after_flush_reads_own_rows(db):
+    user = freelance.User(username='new', email='new@test.ru')
+    db.session.add(user)
+    db.session.flush()
+
+    assert db.session.info.get('writing')
+    assert freelance.User.query.filter_by(email='new@test.ru').first() is user
+
+
+def test_select_outside_write_transaction_uses_read_pool(db):
+    engine = db.session.get_bind(clause=db.select(freelance.User.id))
+    assert engine is not db.engine
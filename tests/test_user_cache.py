@@ -0,0 +1,70 @@
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+import app as freelance
+
+
+def login_moderator(app):
+    client = app.test_client()
+    client.post('/login', data={'email': 'moderator@test.ru', 'password': 'moderator123'})
+    assert client.get('/admin').status_code == 200
+    return client
+
+
+def change_from_other_process(app, sql):
+    # запись мимо сессии и кеша этого процесса, как из другого воркера
+    with app.app_context(), freelance.db.engine.begin() as connection:
+        connection.execute(text(sql + ", session_version = session_version + 1 WHERE email = 'moderator@test.ru'"))
+
+
+def test_ban_from_other_process_ends_session(app):
+    client = login_moderator(app)
+    change_from_other_process(app, 'UPDATE user SET is_active = 0')
+
+    response = client.get('/admin')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+
+
+def test_changed_version_reloads_cached_user(app):
+    client = login_moderator(app)
+    change_from_other_process(app, "UPDATE user SET username = 'renamed'")
+
+    assert 'renamed' in client.get('/admin').get_data(as_text=True)
+
+
+def test_invalidation_bumps_session_version(db):
+    user = freelance.User.query.filter_by(email='moderator@test.ru').one()
+    version = user.session_version
+    freelance.queue_user_cache_invalidation([user.id])
+    db.session.commit()
+
+    assert db.session.scalar(db.select(freelance.User.session_version).where(freelance.User.id == user.id)) == version + 1
+
+
+def test_commit_before_render_keeps_cached_user(app):
+    sender = app.test_client()
+    sender.post('/register', data={'username': 'sender', 'email': 'sender@test.ru',
+                                   'password': 'secret', 'user_type': 'client'})
+    with app.app_context():
+        moderator_id = freelance.User.query.filter_by(email='moderator@test.ru').one().id
+        sender_id = freelance.User.query.filter_by(email='sender@test.ru').one().id
+    sender.post('/api/send_message', json={'receiver_id': moderator_id, 'content': 'Добрый день'})
+    client = login_moderator(app)  # пользователь и профиль уже в кеше
+
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, tuple(parameters)))
+
+    event.listen(Engine, 'before_cursor_execute', collect)
+    try:
+        # диалог с непрочитанным: отметка прочтения и commit до рендера шаблона
+        response = client.get(f'/chats?user_id={sender_id}')
+    finally:
+        event.remove(Engine, 'before_cursor_execute', collect)
+
+    assert response.status_code == 200
+    reloads = [statement for statement, parameters in statements if parameters == (moderator_id,) and (
+        'user.username' in statement or 'FROM profile' in statement)]
+    assert reloads == []